@@ -0,0 +1,635 @@
+"""
+Vectorised analytics over the survey grid.
+
+The grid arrives from the sheet as rows of strings. parse_rows() converts
+it in a single pass into a compact score matrix: one int8 per response,
+stored column by column so each question's scores sit in one contiguous
+array, with the respondent names interned. A response which is blank or
+not a whole score from 1 to 5 is stored as INVALID (0); such cells are
+left out of every statistic, and the first few are kept (with their sheet
+position and value) so they can be reported to the user rather than
+crashing the analysis.
+
+SurveyScores holds the parsed matrix and answers the statistics used by
+the reporting functions in run.py from it. The grid passed in is never
+modified.
+
+RunningAggregates holds a histogram of the scores for each question, kept
+up to date as the survey changes, so the question and organisation
+averages and the distribution of each question's scores (median, mode,
+spread, percentiles and the share of favourable scores) do not need the
+grid at all once built. They can also be built from a stream of rows (see
+storage.iter_rows) in bounded memory.
+
+SegmentedAggregates breaks the survey down by the value of a respondent
+attribute (e.g. department), building the histograms of every segment in
+one pass over the score matrix.
+
+correlation_matrix() correlates every pair of questions at once from their
+joint histograms, built with one matrix product per chunk of the score
+matrix, rather than pair by pair.
+"""
+import math
+import sys
+from itertools import islice
+
+import numpy as np
+
+# Number of rows converted to an array at a time when reading a stream
+CHUNK_SIZE = 1000
+# Code stored in the score matrix for a blank or invalid response
+INVALID = 0
+# Valid responses and the code stored for each
+SCORE_CODES = {str(score): score for score in range(1, 6)}
+# Number of blank or invalid cells kept for reporting
+MAX_REPORTED_CELLS = 10
+# Every score code, as the columns of a RunningAggregates histogram
+SCORE_RANGE = np.arange(INVALID, len(SCORE_CODES) + 1)
+# Scores counted as favourable ("agree" or "strongly agree")
+FAVOURABLE_SCORES = (4, 5)
+# Fewest respondents a segment must have for its results to be reported,
+# so that no individual's responses can be picked out
+MIN_SEGMENT_SIZE = 5
+# Segment of the respondents with no value for the attribute
+NOT_RECORDED = "Not recorded"
+# Methods accepted by correlation_matrix()
+CORRELATION_METHODS = ("pearson", "spearman")
+
+
+def score_code(value):
+    """
+    Returns the code stored in the score matrix for a response: the score
+    itself if it is valid, otherwise INVALID.
+    """
+    return SCORE_CODES.get(str(value).strip(), INVALID)
+
+
+def parse_rows(rows, question_count, first_row=2):
+    """
+    Parses respondent rows (name followed by scores, as strings) in a single
+    pass. Returns the list of interned names, an int8 matrix of score codes
+    with one row per respondent and one column per question, and a list of
+    up to MAX_REPORTED_CELLS (row, column, value) tuples giving the sheet
+    position of blank or invalid cells. Rows are numbered from first_row.
+    """
+    names = []
+    codes = bytearray()
+    bad_cells = []
+    for row_number, row in enumerate(rows, start=first_row):
+        names.append(sys.intern(row[0]) if row else "")
+        for col in range(1, question_count + 1):
+            value = row[col] if col < len(row) else ""
+            code = SCORE_CODES.get(value.strip(), INVALID)
+            if code == INVALID and len(bad_cells) < MAX_REPORTED_CELLS:
+                bad_cells.append((row_number, col + 1, value))
+            codes.append(code)
+    matrix = np.frombuffer(codes, dtype=np.int8).reshape(
+        len(names), question_count)
+    return names, np.asfortranarray(matrix), bad_cells
+
+
+def iter_scores(rows):
+    """
+    Takes respondent rows (name followed by scores, as strings) and yields
+    each as a (name, list of score codes) pair.
+    """
+    for row in rows:
+        yield row[0], [score_code(value) for value in row[1:]]
+
+
+def score_histograms(matrix):
+    """
+    Returns the histogram of each column of a score matrix: an array with
+    one row per question and one column per score code (see SCORE_RANGE)
+    holding the number of respondents who gave it.
+    """
+    return np.stack([(matrix == code).sum(axis=0) for code in SCORE_RANGE],
+                    axis=-1).astype(np.int64).reshape(-1, SCORE_RANGE.size)
+
+
+class SurveyScores:
+    """
+    Compact score matrix for a survey, with per-question and per-respondent
+    statistics computed in vectorised form over the valid responses.
+    """
+
+    def __init__(self, survey_data):
+        headings = survey_data[0] if survey_data else []
+        self._parse(headings, survey_data[1:])
+
+    @classmethod
+    def from_rows(cls, headings, rows):
+        """
+        Builds the matrix from the heading row and an iterable of respondent
+        rows, e.g. streamed from the sheet, without needing the whole grid.
+        """
+        survey_scores = cls.__new__(cls)
+        survey_scores._parse(headings, rows)
+        return survey_scores
+
+    def _parse(self, headings, rows):
+        self.questions = [sys.intern(question) for question in headings[1:]]
+        self.names, self.matrix, self.bad_cells = parse_rows(
+            rows, len(self.questions))
+        self.valid = self.matrix != INVALID
+        self.invalid_count = int(self.matrix.size - self.valid.sum())
+
+    @property
+    def respondent_count(self):
+        return self.matrix.shape[0]
+
+    @property
+    def question_count(self):
+        return self.matrix.shape[1]
+
+    def question_scores(self, question_index):
+        """
+        Returns the int8 array of score codes for one (0-indexed) question.
+        """
+        return self.matrix[:, question_index]
+
+    def question_totals(self):
+        return self.matrix.sum(axis=0, dtype=np.int64)
+
+    def question_counts(self):
+        return self.valid.sum(axis=0)
+
+    def question_means(self):
+        """
+        Returns the average valid score for each question, or nan where it
+        has none.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.question_totals() / self.question_counts()
+
+    def overall_mean(self):
+        """
+        Returns the average of every valid score in the survey, or nan if
+        there are none.
+        """
+        count = int(self.valid.sum())
+        if count == 0:
+            return math.nan
+        return int(self.matrix.sum(dtype=np.int64)) / count
+
+    def respondent_counts(self):
+        return self.valid.sum(axis=1)
+
+    def respondent_means(self):
+        return self.matrix.sum(axis=1, dtype=np.int64) \
+            / self.respondent_counts()
+
+    def respondent_minimums(self):
+        """
+        Returns each respondent's lowest valid score, or INVALID if they have
+        none.
+        """
+        highest = max(SCORE_CODES.values()) + 1
+        minimums = np.where(self.valid, self.matrix, highest).min(
+            axis=1, initial=highest)
+        return np.where(minimums == highest, INVALID, minimums)
+
+    def respondent_maximums(self):
+        return self.matrix.max(axis=1, initial=INVALID)
+
+    def respondent_variances(self):
+        """
+        Returns the sample variance of each respondent's valid scores.
+        Computed from integer sums so that the result is exact before the
+        single division, matching statistics.variance.
+        """
+        matrix = self.matrix.astype(np.int64)
+        counts = self.respondent_counts()
+        totals = matrix.sum(axis=1)
+        squares = (matrix * matrix).sum(axis=1)
+        return (counts * squares - totals * totals) / (counts * (counts - 1))
+
+    def respondent_summary(self, index):
+        """
+        Returns the mean, variance, minimum and maximum of the valid scores
+        for the respondent in the given (0-indexed) row of the matrix. The
+        variance is 0 if fewer than two of their scores are valid.
+        """
+        scores = self.matrix[index]
+        scores = scores[scores != INVALID].astype(np.int64)
+        count = len(scores)
+        if count == 0:
+            return {"mean": 0.0, "variance": 0.0, "min": INVALID,
+                    "max": INVALID}
+        total = int(scores.sum())
+        squares = int((scores * scores).sum())
+        variance = 0.0
+        if count > 1:
+            variance = (count * squares - total * total) \
+                / (count * (count - 1))
+        return {
+            "mean": total / count,
+            "variance": variance,
+            "min": int(scores.min()),
+            "max": int(scores.max()),
+            }
+
+
+class RunningAggregates:
+    """
+    Per-question histograms of the scores: for each question, the number of
+    respondents who gave each score code (column INVALID counting the blank
+    or invalid responses). Built in one pass over a score matrix, then
+    updated in place as responses and questions are added, changed or
+    deleted. As Likert scores take only five values, the sums, counts,
+    means and variances as well as the exact medians, modes, percentiles
+    and percentile ranks are all answered from the histograms in
+    O(questions) without rescanning the survey. Also keeps the examples of
+    blank or invalid cells found when built until a deletion moves them.
+    """
+
+    def __init__(self, histograms, respondent_count=0, bad_cells=None):
+        self.histograms = np.asarray(histograms, dtype=np.int64).reshape(
+            -1, SCORE_RANGE.size)
+        self.respondent_count = respondent_count
+        self.bad_cells = list(bad_cells or [])
+
+    @classmethod
+    def empty(cls, question_count):
+        return cls(np.zeros((question_count, SCORE_RANGE.size)))
+
+    @classmethod
+    def from_scores(cls, survey_scores):
+        return cls(score_histograms(survey_scores.matrix),
+                   survey_scores.respondent_count, survey_scores.bad_cells)
+
+    @classmethod
+    def from_rows(cls, rows, question_count):
+        """
+        Builds the aggregates from an iterable of respondent rows, parsing
+        CHUNK_SIZE rows at a time so memory use does not grow with the size
+        of the survey.
+        """
+        aggregates = cls.empty(question_count)
+        rows = iter(rows)
+        first_row = 2
+        while True:
+            chunk = list(islice(rows, CHUNK_SIZE))
+            if not chunk:
+                return aggregates
+            _, matrix, bad_cells = parse_rows(chunk, question_count,
+                                              first_row)
+            aggregates.histograms += score_histograms(matrix)
+            aggregates.respondent_count += len(chunk)
+            aggregates.bad_cells.extend(
+                bad_cells[:MAX_REPORTED_CELLS - len(aggregates.bad_cells)])
+            first_row += len(chunk)
+
+    @property
+    def question_count(self):
+        return len(self.histograms)
+
+    @property
+    def counts(self):
+        """
+        Number of valid responses to each question.
+        """
+        return self.histograms[:, INVALID + 1:].sum(axis=1)
+
+    @property
+    def sums(self):
+        return self.histograms @ SCORE_RANGE
+
+    @property
+    def squares(self):
+        return self.histograms @ (SCORE_RANGE * SCORE_RANGE)
+
+    @property
+    def invalid_count(self):
+        return int(self.histograms[:, INVALID].sum())
+
+    def matches(self, other):
+        """
+        Returns True if both sets of aggregates hold the same values.
+        """
+        return np.array_equal(self.histograms, other.histograms) \
+            and self.respondent_count == other.respondent_count
+
+    def add_respondent(self, scores):
+        """
+        Adds a respondent's scores. Blank trailing responses may be left out
+        of the list given.
+        """
+        self.histograms[np.arange(self.question_count),
+                        self._codes(scores)] += 1
+        self.respondent_count += 1
+
+    def add_respondents(self, rows):
+        """
+        Adds several respondents at once, from rows holding a name followed
+        by scores.
+        """
+        _, matrix, _ = parse_rows(rows, self.question_count)
+        self.histograms += score_histograms(matrix)
+        self.respondent_count += len(rows)
+
+    def remove_respondent(self, scores):
+        """
+        Removes a respondent's scores. Blank trailing responses may be left
+        out of the list given.
+        """
+        self.histograms[np.arange(self.question_count),
+                        self._codes(scores)] -= 1
+        self.respondent_count -= 1
+        self.bad_cells = []
+
+    def _codes(self, scores):
+        codes = np.full(self.question_count, INVALID, dtype=np.int64)
+        codes[:len(scores)] = [score_code(score) for score in scores]
+        return codes
+
+    def update_score(self, question_index, old_score, new_score):
+        old_code = score_code(old_score)
+        self.histograms[question_index, old_code] -= 1
+        self.histograms[question_index, score_code(new_score)] += 1
+        if old_code == INVALID:
+            self.bad_cells = []
+
+    def add_questions(self, number, default_score, respondent_count):
+        """
+        Adds aggregates for new questions answered with the default score by
+        every existing respondent.
+        """
+        new_histograms = np.zeros((number, SCORE_RANGE.size), dtype=np.int64)
+        new_histograms[:, score_code(default_score)] = respondent_count
+        self.histograms = np.vstack([self.histograms, new_histograms])
+
+    def remove_question(self, question_index):
+        self.histograms = np.delete(self.histograms, question_index, axis=0)
+        self.bad_cells = []
+
+    def question_means(self):
+        """
+        Returns the average valid score for each question, or nan where it
+        has none.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums / self.counts
+
+    def question_variances(self):
+        """
+        Returns the sample variance of the valid scores for each question.
+        """
+        counts = self.counts
+        sums = self.sums
+        return (counts * self.squares - sums * sums) \
+            / (counts * (counts - 1))
+
+    def question_standard_deviations(self):
+        """
+        Returns the sample standard deviation of the valid scores for each
+        question, or nan where there are fewer than two.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(self.question_variances())
+
+    def overall_mean(self):
+        """
+        Returns the average of every valid score, or nan if there are none
+        (e.g. straight after a round's responses have been cleared).
+        """
+        count = int(self.counts.sum())
+        if count == 0:
+            return math.nan
+        return int(self.sums.sum()) / count
+
+    def _scores_at(self, positions):
+        """
+        Returns, for each question, the score at the given position (from 0)
+        in its valid scores sorted in ascending order.
+        """
+        cumulative = self.histograms[:, INVALID + 1:].cumsum(axis=1)
+        return (cumulative <= np.asarray(positions)[:, None]).sum(axis=1) \
+            + INVALID + 1
+
+    def question_medians(self):
+        """
+        Returns the median valid score for each question: the middle score,
+        or the mean of the two middle scores if there is an even number.
+        Questions with no valid scores give nan.
+        """
+        counts = self.counts
+        medians = (self._scores_at((counts - 1) // 2)
+                   + self._scores_at(counts // 2)) / 2
+        return np.where(counts > 0, medians, np.nan)
+
+    def question_modes(self):
+        """
+        Returns the most common valid score for each question (the lowest of
+        them if several are equally common), or 0 if there are none.
+        """
+        modes = self.histograms[:, INVALID + 1:].argmax(axis=1) + INVALID + 1
+        return np.where(self.counts > 0, modes, 0)
+
+    def question_percentiles(self, percentile):
+        """
+        Returns the given percentile (0-100) of the valid scores for each
+        question, by the nearest-rank method, or 0 if there are none.
+        """
+        counts = self.counts
+        ranks = np.ceil(percentile / 100 * counts).astype(np.int64)
+        scores = self._scores_at(np.maximum(ranks - 1, 0))
+        return np.where(counts > 0, scores, 0)
+
+    def question_favourable(self):
+        """
+        Returns the percentage of the valid scores for each question which
+        are favourable (see FAVOURABLE_SCORES), or nan if there are none.
+        """
+        favourable = self.histograms[:, list(FAVOURABLE_SCORES)].sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return favourable / self.counts * 100
+
+    def percentile_ranks(self, codes):
+        """
+        Returns the percentile rank of a respondent's score code on each
+        question: the percentage of valid scores below it, counting half of
+        those equal to it. Blank or invalid scores give nan.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        rows = np.arange(self.question_count)
+        below = self.histograms[:, INVALID + 1:].cumsum(axis=1)
+        below = np.hstack([np.zeros((self.question_count, 1),
+                                    dtype=np.int64), below])
+        equal = self.histograms[rows, codes]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ranks = (below[rows, codes - 1] + equal / 2) / self.counts * 100
+        return np.where(codes != INVALID, ranks, np.nan)
+
+
+def group_histograms(matrix, groups, group_count):
+    """
+    Returns the score histograms of each group of respondents in a single
+    pass over the score matrix: an array holding, for each group, one
+    histogram per question (as score_histograms()). groups gives the group
+    (from 0) of each row of the matrix.
+    """
+    width = SCORE_RANGE.size
+    offsets = np.asarray(groups, dtype=np.int64) * width
+    histograms = np.zeros((group_count, matrix.shape[1], width),
+                          dtype=np.int64)
+    for question_index in range(matrix.shape[1]):
+        histograms[:, question_index] = np.bincount(
+            offsets + matrix[:, question_index],
+            minlength=group_count * width).reshape(group_count, width)
+    return histograms
+
+
+class SegmentedAggregates:
+    """
+    The survey broken down by the value of one respondent attribute, with
+    RunningAggregates for each segment (in label order, with NOT_RECORDED
+    last). Segments with fewer than MIN_SEGMENT_SIZE respondents are held
+    but should only be reported through reportable() and suppressed(),
+    which also hold back a further segment where needed to protect them.
+    """
+
+    def __init__(self, attribute, segments):
+        self.attribute = attribute
+        self.segments = segments
+
+    @classmethod
+    def group(cls, survey_scores, attribute, labels):
+        """
+        Groups the respondents of an analytics.SurveyScores matrix by their
+        segment labels, given in the order of its rows.
+        """
+        segment_labels = sorted(set(labels),
+                                key=lambda label: (label == NOT_RECORDED,
+                                                   label.lower()))
+        positions = {label: index
+                     for index, label in enumerate(segment_labels)}
+        groups = [positions[label] for label in labels]
+        histograms = group_histograms(survey_scores.matrix, groups,
+                                      len(segment_labels))
+        sizes = np.bincount(np.asarray(groups, dtype=np.int64),
+                            minlength=len(segment_labels))
+        return cls(attribute, {
+            label: RunningAggregates(histograms[index], int(sizes[index]))
+            for index, label in enumerate(segment_labels)})
+
+    def reportable(self, min_size=MIN_SEGMENT_SIZE):
+        """
+        Returns the segments which may be reported, as a dict from label to
+        RunningAggregates (see suppressed()).
+        """
+        suppressed = self.suppressed(min_size)
+        return {label: segment for label, segment in self.segments.items()
+                if label not in suppressed}
+
+    def suppressed(self, min_size=MIN_SEGMENT_SIZE):
+        """
+        Returns the labels of the segments which must not be reported: those
+        with fewer than min_size respondents and, if these together have
+        fewer than min_size, the next smallest segment too. Otherwise the
+        small segments' results could be worked out by subtracting the
+        reported segments from the organisation's.
+        """
+        suppressed = [label for label, segment in self.segments.items()
+                      if segment.respondent_count < min_size]
+        suppressed_count = sum(self.segments[label].respondent_count
+                               for label in suppressed)
+        remaining = [label for label in self.segments
+                     if label not in suppressed]
+        if suppressed and suppressed_count < min_size and remaining:
+            suppressed.append(min(
+                remaining,
+                key=lambda label: self.segments[label].respondent_count))
+        return suppressed
+
+
+def joint_histograms(matrix):
+    """
+    Returns, for every pair of questions i and j, the number of respondents
+    who gave each pair of valid score codes: counts[i, j, a - 1, b - 1]
+    respondents scored a on question i and b on question j. Built with a
+    single matrix product of the one-hot encoded scores for each CHUNK_SIZE
+    respondents.
+    """
+    question_count = matrix.shape[1]
+    scores = SCORE_RANGE[INVALID + 1:]
+    size = len(scores) * question_count
+    counts = np.zeros((size, size))
+    for start in range(0, matrix.shape[0], CHUNK_SIZE):
+        codes = matrix[start:start + CHUNK_SIZE]
+        # column a * question_count + i marks respondents scoring a + 1 on i
+        one_hot = np.concatenate([codes == score for score in scores],
+                                 axis=1).astype(np.float32)
+        counts += one_hot.T @ one_hot
+    return counts.reshape(len(scores), question_count, len(scores),
+                          question_count).transpose(1, 3, 0, 2)
+
+
+def pairwise_ranks(counts):
+    """
+    Returns the ranks of each valid score code of questions i and j among
+    the respondents with valid scores to both (from 1, with tied scores
+    taking their average rank), given the pairs' joint histograms.
+    """
+    first = counts.sum(axis=3)
+    second = counts.sum(axis=2)
+    return (first.cumsum(axis=2) - first + (first + 1) / 2,
+            second.cumsum(axis=2) - second + (second + 1) / 2)
+
+
+def correlation_matrix(matrix, method="pearson"):
+    """
+    Returns the question-by-question correlation matrix of a score matrix.
+    Each pair of questions is correlated over the respondents with valid
+    scores to both. "pearson" correlates the scores themselves and
+    "spearman" their ranks, ranked afresh among those respondents for each
+    pair (see pairwise_ranks()). Pairs with fewer than two respondents in
+    common, or where either question's scores do not vary among them, give
+    nan.
+
+    As each score takes one of five values, every sum needed is answered
+    from the pairs' joint histograms (see joint_histograms()), built for
+    all pairs at once over CHUNK_SIZE respondents at a time, so memory use
+    does not grow with the number of respondents.
+    """
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"Unknown correlation method '{method}'")
+    counts = joint_histograms(matrix)
+    pairs = counts.sum(axis=(2, 3))
+    if method == "spearman":
+        first, second = pairwise_ranks(counts)
+    else:
+        scores = SCORE_RANGE[INVALID + 1:].astype(np.float64)
+        first = np.broadcast_to(scores, counts.shape[:3])
+        second = first
+    with np.errstate(divide="ignore", invalid="ignore"):
+        first_sums = np.einsum("ijab,ija->ij", counts, first)
+        second_sums = np.einsum("ijab,ijb->ij", counts, second)
+        covariances = np.einsum("ijab,ija,ijb->ij", counts, first, second) \
+            - first_sums * second_sums / pairs
+        first_variances = np.einsum("ijab,ija->ij", counts, first * first) \
+            - first_sums * first_sums / pairs
+        second_variances = np.einsum("ijab,ijb->ij", counts,
+                                     second * second) \
+            - second_sums * second_sums / pairs
+        correlations = covariances \
+            / np.sqrt(first_variances * second_variances)
+    undefined = (pairs < 2) | (first_variances <= 1e-9) \
+        | (second_variances <= 1e-9)
+    correlations[undefined] = np.nan
+    return np.clip(correlations, -1, 1)
+
+
+def strongest_pairs(correlations, count=None):
+    """
+    Returns (question index, question index, correlation) for each pair of
+    different questions, strongest (by absolute correlation) first, leaving
+    out undefined correlations. Returns the first count pairs if given.
+    """
+    rows, cols = np.triu_indices(len(correlations), k=1)
+    values = correlations[rows, cols]
+    defined = ~np.isnan(values)
+    rows, cols, values = rows[defined], cols[defined], values[defined]
+    order = np.argsort(-np.abs(values), kind="stable")[:count]
+    return [(int(rows[index]), int(cols[index]), float(values[index]))
+            for index in order]
@@ -0,0 +1,251 @@
+"""
+Benchmarks for the survey commands, run against synthetic surveys.
+
+Generates surveys of each requested size (respondents x questions) with
+realistic scores: each question has its own typical score, each respondent
+is more or less generous than average, and every response varies around
+both, rounded and clipped to 1-5. Each operation is then run against an
+in-memory LocalWorksheet (see storage.py) wrapped by the tracer (see
+tracing.py), starting from an empty snapshot as a new command would, and
+reported with its wall time (best of --repeat runs), peak memory allocated
+(measured in a separate run, as tracing memory slows the code down) and
+the number of worksheet calls it made - the requests it would have sent to
+the Sheets API.
+
+    python3 benchmark.py
+    python3 benchmark.py --respondents 100 100000 --questions 5 200
+    python3 benchmark.py --save baseline.json
+    python3 benchmark.py --compare baseline.json
+
+With --compare, each result is compared with the saved baseline for the
+same operation and size, and marked as a regression if it is more than
+--tolerance slower or makes more calls; the exit status is then 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+# The local backend needs no credentials and the output is discarded
+os.environ["SURVEY_BACKEND"] = "local"
+os.environ["NO_COLOR"] = "1"
+
+import numpy as np  # noqa: E402
+
+import run  # noqa: E402
+import snapshot  # noqa: E402
+import storage  # noqa: E402
+import tracing  # noqa: E402
+
+RESPONDENTS = [100, 1000, 10000]
+QUESTIONS = [5, 20]
+REPEAT = 3
+SEED = 2024
+# Fraction by which an operation may be slower than the baseline
+TOLERANCE = 0.2
+
+
+def generate_survey(respondent_count, question_count, seed=SEED):
+    """
+    Returns a LocalWorksheet holding a synthetic survey of the given size.
+    """
+    rng = np.random.default_rng(seed)
+    question_centres = rng.uniform(1.8, 4.2, question_count)
+    respondent_bias = rng.normal(0, 0.5, (respondent_count, 1))
+    noise = rng.normal(0, 0.9, (respondent_count, question_count))
+    scores = np.clip(np.rint(question_centres + respondent_bias + noise),
+                     1, 5).astype(int)
+    headings = ["Name"] + [f"Q{number} - Aspect {number}"
+                           for number in range(1, question_count + 1)]
+    questions = ["benchmark"] + [
+        f"Q{number} - How would you rate aspect {number}?"
+        for number in range(1, question_count + 1)]
+    values = [headings] + [
+        [f"Respondent {index:06d}"] + [str(score) for score in row]
+        for index, row in enumerate(scores.tolist(), start=1)]
+    notes = [questions]
+    return storage.LocalWorksheet(values, notes)
+
+
+def copy_survey(template):
+    return storage.LocalWorksheet(template.get_all_values(),
+                                  template.get_notes())
+
+
+def get_averages():
+    run.get_averages(run.SNAPSHOT.aggregates(), False)
+
+
+def analyse_survey():
+    run.get_data_insights(run.analyse_survey())
+
+
+def analyse_respondent_data():
+    names = run.SNAPSHOT.respondent_names()
+    name = names[len(names) // 2]
+    run.analyse_respondent_data(run.read_respondent_data(name))
+
+
+def read_question_data():
+    run.read_question_data(1)
+
+
+def analyse_correlations():
+    run.analyse_correlations("pearson")
+
+
+def update_question_cells():
+    # deleting the first question renumbers every question after it
+    run.delete_question()
+
+
+# Each operation with the menu command it belongs to and the answers it is
+# given to any prompts
+OPERATIONS = {
+    "get_averages": (get_averages, "analyse", []),
+    "analyse_survey": (analyse_survey, "analyse", []),
+    "analyse_respondent_data": (analyse_respondent_data, "read", []),
+    "read_question_data": (read_question_data, "read q", []),
+    "analyse_correlations": (analyse_correlations, "correlate", []),
+    "add_question": (run.add_question, "add q",
+                     ["How would you rate the benchmark?", "Benchmark",
+                      "n"]),
+    "update_question_cells": (update_question_cells, "delete q", ["1"]),
+    }
+
+
+def run_operation(template, name, measure_memory=False):
+    """
+    Runs one operation against a fresh copy of the survey. Returns the wall
+    time in seconds, the peak memory allocated in bytes (if measured) and
+    the number of worksheet calls made.
+    """
+    function, command, answers = OPERATIONS[name]
+    tracer = tracing.Tracer(enabled=True, trace_file=None)
+    run.SURVEY = tracer.wrap(copy_survey(template))
+    run.SNAPSHOT = snapshot.SurveySnapshot(run.SURVEY)
+    answers = iter(answers)
+    peak = None
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull), \
+            mock.patch("builtins.input",
+                       lambda prompt="": next(answers)):
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        run.SNAPSHOT.refresh()
+        run.SNAPSHOT.prefetch(*run.COMMAND_READS.get(command, ()))
+        function()
+        seconds = time.perf_counter() - start
+        if measure_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    calls = sum(totals.calls for totals in tracer.methods.values())
+    return seconds, peak, calls
+
+
+def run_benchmarks(respondent_counts, question_counts, operations, repeat):
+    results = []
+    for respondent_count in respondent_counts:
+        for question_count in question_counts:
+            template = generate_survey(respondent_count, question_count)
+            for name in operations:
+                times = []
+                for _ in range(repeat):
+                    seconds, _, calls = run_operation(template, name)
+                    times.append(seconds)
+                _, peak, _ = run_operation(template, name,
+                                           measure_memory=True)
+                result = {
+                    "operation": name,
+                    "respondents": respondent_count,
+                    "questions": question_count,
+                    "seconds": min(times),
+                    "peak_bytes": peak,
+                    "api_calls": calls,
+                    }
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def result_key(result):
+    return (result["operation"], result["respondents"], result["questions"])
+
+
+def print_result(result, baseline=None, tolerance=TOLERANCE):
+    """
+    Prints a result, with its change from the baseline result if given.
+    Returns True if it is a regression on the baseline.
+    """
+    line = (f"{result['operation']:<25}{result['respondents']:>12}"
+            f"{result['questions']:>6}{result['seconds'] * 1000:>12.2f}"
+            f"{result['peak_bytes'] / 1024:>12.0f}{result['api_calls']:>7}")
+    regression = False
+    if baseline is not None:
+        ratio = result["seconds"] / baseline["seconds"] \
+            if baseline["seconds"] else 1
+        regression = ratio > 1 + tolerance \
+            or result["api_calls"] > baseline["api_calls"]
+        line += f"{ratio:>9.2f}x" + ("  REGRESSION" if regression else "")
+    print(line)
+    return regression
+
+
+def compare(results, baseline_results, tolerance):
+    """
+    Prints each result against the baseline. Returns True if any of them
+    has regressed.
+    """
+    baseline = {result_key(result): result for result in baseline_results}
+    print("\nCOMPARISON WITH BASELINE")
+    regressed = False
+    for result in results:
+        if result_key(result) in baseline:
+            regressed |= print_result(result, baseline[result_key(result)],
+                                      tolerance)
+    return regressed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py",
+        description="Benchmark survey commands on synthetic surveys.")
+    parser.add_argument("--respondents", type=int, nargs="+",
+                        default=RESPONDENTS)
+    parser.add_argument("--questions", type=int, nargs="+",
+                        default=QUESTIONS)
+    parser.add_argument("--operations", nargs="+", default=list(OPERATIONS),
+                        choices=list(OPERATIONS))
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--save", metavar="PATH",
+                        help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print(f"{'OPERATION':<25}{'RESPONDENTS':>12}{'QS':>6}{'MS':>12}"
+          f"{'PEAK KB':>12}{'CALLS':>7}")
+    results = run_benchmarks(args.respondents, args.questions,
+                             args.operations, args.repeat)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline_results = json.load(baseline_file)
+        if compare(results, baseline_results, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,495 @@
+"""
+Headless command mode for scripts, cron jobs and pipelines.
+
+Runs a single survey command given on the command line, without any
+prompts or colouring, and writes the result to stdout either as plain
+tab-separated text or, with --json, as one JSON document. Progress
+messages from the shared functions in run.py go to stderr.
+
+    python3 cli.py list
+    python3 cli.py read "Jane Doe" --json
+    python3 cli.py read-q 3
+    python3 cli.py read-all > survey.tsv
+    python3 cli.py analyse --json
+    python3 cli.py add "Jane Doe" 4 3 5 2
+    python3 cli.py import responses.csv
+    python3 cli.py export nightly/
+    python3 cli.py segment Department --json
+    python3 cli.py correlate --method spearman --top 20
+    python3 cli.py close-round "2024 Spring" --clear
+    python3 cli.py trend --json
+
+Every command except 'add' needs administrator access, given by setting the
+SURVEY_ADMIN_PASSWORD environment variable to the password held in the note
+of cell A1. The exit status is 0 on success, 1 if the command fails (e.g.
+an unknown respondent) and 2 for invalid arguments.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import sys
+
+import gspread
+import requests
+
+# Must be set before the first coloured message, as termcolor caches it
+os.environ["NO_COLOR"] = "1"
+
+import analytics  # noqa: E402
+import rounds  # noqa: E402
+import run  # noqa: E402
+import survey_io  # noqa: E402
+import tracing  # noqa: E402
+
+ADMIN_COMMANDS = ["list", "read", "read-q", "read-all", "analyse",
+                  "import", "export", "segment", "correlate", "close-round",
+                  "trend"]
+
+
+class CommandError(Exception):
+    """
+    Raised when a command cannot be carried out with the given arguments.
+    """
+
+
+def number(value):
+    """
+    Converts a statistic to a JSON-safe number: None where it is undefined
+    (e.g. the mean of a question with no valid responses).
+    """
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def check_password():
+    admin_password = run.SNAPSHOT.admin_password()
+    if os.environ.get("SURVEY_ADMIN_PASSWORD") != admin_password:
+        raise CommandError("Administrator access required: set "
+                           "SURVEY_ADMIN_PASSWORD to the admin password.")
+
+
+def find_respondent(name):
+    row = run.SNAPSHOT.respondent_row(name)
+    if row is None:
+        raise CommandError(f"No respondent named '{name}'.")
+    return row
+
+
+def require_responses():
+    """
+    Raises CommandError if the survey holds no valid responses to report
+    on, e.g. straight after a round's responses have been cleared. Decided
+    from the score matrix, which the command reads anyway.
+    """
+    if not run.SNAPSHOT.scores().valid.any():
+        raise CommandError("There are no responses to the survey yet.")
+
+
+def list_command(args):
+    return {"respondents": run.SNAPSHOT.respondent_names()}
+
+
+def read_command(args):
+    """
+    Returns a respondent's scores (None where blank or invalid) with their
+    mean, variance, lowest and highest score and their percentile rank on
+    each question.
+    """
+    row = find_respondent(args.name)
+    survey_scores = run.SNAPSHOT.scores()
+    scores = survey_scores.matrix[row - 2].tolist()
+    summary = survey_scores.respondent_summary(row - 2)
+    ranks = run.SNAPSHOT.aggregates().percentile_ranks(scores)
+    return {
+        "name": args.name,
+        "scores": {
+            question: None if score == analytics.INVALID else score
+            for question, score in zip(survey_scores.questions, scores)},
+        "mean": summary["mean"],
+        "variance": summary["variance"],
+        "min": summary["min"],
+        "max": summary["max"],
+        "percentile_ranks": {
+            question: number(rank)
+            for question, rank in zip(survey_scores.questions, ranks)},
+        }
+
+
+def read_question_command(args):
+    """
+    Returns every respondent's response to one question, with the average
+    and the distribution of the scores.
+    """
+    questions = run.get_questions("summarised")
+    if not 1 <= args.question <= len(questions):
+        raise CommandError(f"Question number must be between 1 and "
+                           f"{len(questions)}.")
+    names = run.SNAPSHOT.respondent_names()
+    responses = run.SNAPSHOT.col_values(args.question + 1)[1:]
+    responses += [""] * (len(names) - len(responses))
+    survey_aggregates = run.SNAPSHOT.aggregates()
+    index = args.question - 1
+    return {
+        "question": questions[index],
+        "responses": dict(zip(names, responses)),
+        "mean": number(survey_aggregates.question_means()[index]),
+        "histogram": survey_aggregates.histograms[
+            index, analytics.INVALID + 1:].tolist(),
+        "median": number(survey_aggregates.question_medians()[index]),
+        "mode": int(survey_aggregates.question_modes()[index]) or None,
+        "standard_deviation": number(
+            survey_aggregates.question_standard_deviations()[index]),
+        "favourable_percent": number(
+            survey_aggregates.question_favourable()[index]),
+        }
+
+
+def read_all_command(args):
+    """
+    Returns the questions and every respondent's row. Rows are streamed
+    from the sheet, so in plain output they are written as they arrive.
+    """
+    return {
+        "questions": run.get_questions("full"),
+        "rows": run.SNAPSHOT.iter_respondent_rows(),
+        }
+
+
+def analyse_command(args):
+    """
+    Returns the organisation and per-question averages, the per-question
+    medians, modes, standard deviations and percentage of favourable scores,
+    the low and high scoring questions (as in the interactive 'analyse'
+    command) and the number of blank or invalid responses left out.
+    """
+    require_responses()
+    survey_aggregates = run.SNAPSHOT.aggregates()
+    questions = run.get_questions("summarised")
+    question_means = survey_aggregates.question_means()
+    averages = run.get_averages(survey_aggregates, False)
+    return {
+        "overall_mean": number(survey_aggregates.overall_mean()),
+        "question_means": {
+            question: number(mean)
+            for question, mean in zip(questions, question_means)},
+        "question_medians": {
+            question: number(median) for question, median
+            in zip(questions, survey_aggregates.question_medians())},
+        "question_modes": {
+            question: int(mode) or None for question, mode
+            in zip(questions, survey_aggregates.question_modes())},
+        "question_standard_deviations": {
+            question: number(deviation) for question, deviation
+            in zip(questions,
+                   survey_aggregates.question_standard_deviations())},
+        "question_favourable_percent": {
+            question: number(favourable) for question, favourable
+            in zip(questions, survey_aggregates.question_favourable())},
+        "low_scoring": [question for question, average
+                        in zip(questions, averages) if float(average) <= 2.5],
+        "high_scoring": [question for question, average
+                         in zip(questions, averages)
+                         if float(average) >= 3.5],
+        "invalid_responses": survey_aggregates.invalid_count,
+        }
+
+
+def add_command(args):
+    """
+    Adds a new respondent with one score per question.
+    """
+    if run.SNAPSHOT.respondent_row(args.name) is not None:
+        raise CommandError(f"Respondent '{args.name}' already exists.")
+    question_count = len(run.get_questions("summarised"))
+    if len(args.scores) != question_count:
+        raise CommandError(f"Expected {question_count} scores, got "
+                           f"{len(args.scores)}.")
+    if any(analytics.score_code(score) == analytics.INVALID
+           for score in args.scores):
+        raise CommandError("Scores must be whole numbers from 1 to 5.")
+    with contextlib.redirect_stdout(sys.stderr):
+        run.update_survey_sheet([args.name] + args.scores)
+    return {"added": args.name}
+
+
+def import_command(args):
+    """
+    Imports the valid respondents from a CSV file (see survey_io.py) in
+    batches, and lists the rejected lines.
+    """
+    try:
+        rows, rejected = survey_io.read_import_file(
+            args.path, len(run.get_questions("summarised")),
+            run.SNAPSHOT.respondent_names())
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise CommandError(f"The file could not be read ({error}).")
+    for batch in survey_io.append_in_batches(run.SURVEY, rows):
+        run.SNAPSHOT.respondents_added(batch)
+    return {
+        "imported": len(rows),
+        "rejected": {line_number: reason
+                     for line_number, reason in rejected},
+        }
+
+
+def export_command(args):
+    """
+    Exports the survey data and statistics to files (see survey_io.py).
+    """
+    exported = survey_io.export_survey(
+        run.SNAPSHOT, run.get_questions("full"), args.directory)
+    return {"exported": exported, "directory": args.directory}
+
+
+def segment_command(args):
+    """
+    Returns the survey broken down by a respondent attribute: the size,
+    average score and per-question averages and percentage of favourable
+    scores of each reportable segment, and the labels of the segments left
+    out to keep responses anonymous (see analytics.SegmentedAggregates).
+    """
+    require_responses()
+    attribute_names = run.SNAPSHOT.attributes()[0]
+    matches = [name for name in attribute_names
+               if name.strip().lower() == args.attribute.strip().lower()]
+    if not matches:
+        raise CommandError(f"No respondent attribute named "
+                           f"'{args.attribute}'.")
+    segmented = run.get_segments(matches[0])
+    segments = segmented.reportable()
+    questions = run.get_questions("summarised")
+    return {
+        "attribute": matches[0],
+        "segment_sizes": {label: segment.respondent_count
+                          for label, segment in segments.items()},
+        "segment_means": {
+            label: number(segment.overall_mean())
+            for label, segment in segments.items()},
+        "question_means": {
+            label: {question: number(mean) for question, mean
+                    in zip(questions, segment.question_means())}
+            for label, segment in segments.items()},
+        "question_favourable_percent": {
+            label: {question: number(favourable) for question, favourable
+                    in zip(questions, segment.question_favourable())}
+            for label, segment in segments.items()},
+        "suppressed": segmented.suppressed(),
+        }
+
+
+def correlate_command(args):
+    """
+    Returns the most strongly correlated pairs of questions, strongest
+    first, and with --matrix the full question-by-question matrix.
+    """
+    require_responses()
+    questions = run.get_questions("summarised")
+    correlations = run.SNAPSHOT.correlations(args.method)
+    result = {
+        "method": args.method,
+        "pairs": {
+            f"{questions[first]} & {questions[second]}": correlation
+            for first, second, correlation
+            in analytics.strongest_pairs(correlations, args.top)},
+        }
+    if args.matrix:
+        result["matrix"] = {
+            question: {other: number(correlation) for other, correlation
+                       in zip(questions, correlations[index])}
+            for index, question in enumerate(questions)}
+    return result
+
+
+def close_round_command(args):
+    """
+    Saves the current round of the survey (see rounds.py) and, with
+    --clear, deletes its responses ready for the next round.
+    """
+    respondent_count = len(run.SNAPSHOT.respondent_names())
+    if respondent_count == 0:
+        raise CommandError("There are no responses in the current round.")
+    if not args.name.strip():
+        raise CommandError("The round needs a name.")
+    if rounds.is_reserved_name(args.name):
+        raise CommandError(f"'{rounds.CURRENT_ROUND}' is the label of the "
+                           "current round; choose another name.")
+    path = rounds.close_round(run.SNAPSHOT, run.get_questions("full"),
+                              args.name)
+    if args.clear:
+        run.SURVEY.delete_rows(2, respondent_count + 1)
+        run.SNAPSHOT.respondents_cleared()
+    return {"closed": args.name, "path": path,
+            "respondents": respondent_count, "cleared": args.clear}
+
+
+def trend_command(args):
+    """
+    Returns the number of respondents and the average score of each round,
+    and each question's average and percentage of favourable scores in the
+    rounds that asked it.
+    """
+    survey_rounds = run.get_survey_rounds()
+    if not survey_rounds:
+        raise CommandError("No rounds have been saved yet.")
+    question_means = {}
+    question_favourable = {}
+    for key, summary in rounds.trend_questions(survey_rounds):
+        question_means[summary] = {}
+        question_favourable[summary] = {}
+        for survey_round, question in zip(
+                survey_rounds, rounds.question_trend(survey_rounds, key)):
+            if question is None:
+                continue
+            aggregates, index = question
+            question_means[summary][survey_round.name] = number(
+                aggregates.question_means()[index])
+            question_favourable[summary][survey_round.name] = number(
+                aggregates.question_favourable()[index])
+    return {
+        "rounds": [survey_round.name for survey_round in survey_rounds],
+        "round_sizes": {survey_round.name:
+                        survey_round.aggregates.respondent_count
+                        for survey_round in survey_rounds},
+        "round_means": {
+            survey_round.name: number(survey_round.aggregates.overall_mean())
+            for survey_round in survey_rounds},
+        "question_means": question_means,
+        "question_favourable_percent": question_favourable,
+        }
+
+
+def write_plain(result, out):
+    """
+    Writes a result as tab-separated lines: one line per scalar or list
+    value, one per entry of a mapping (or of each mapping within it) and one
+    per streamed row.
+    """
+    for key, value in result.items():
+        if isinstance(value, dict):
+            for item, item_value in value.items():
+                if isinstance(item_value, dict):
+                    for sub_item, sub_value in item_value.items():
+                        print(key, item, sub_item,
+                              "" if sub_value is None else sub_value,
+                              sep="\t", file=out)
+                    continue
+                print(key, item, "" if item_value is None else item_value,
+                      sep="\t", file=out)
+        elif isinstance(value, list):
+            print(key, *value, sep="\t", file=out)
+        elif isinstance(value, (str, int, float)) or value is None:
+            print(key, "" if value is None else value, sep="\t", file=out)
+        else:
+            for row in value:
+                print(*row, sep="\t", file=out)
+
+
+def write_json(result, out):
+    result = {key: value if isinstance(value, (dict, list, str, int, float))
+              or value is None else list(value)
+              for key, value in result.items()}
+    json.dump(result, out, indent=2)
+    out.write("\n")
+
+
+def build_parser():
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--json", action="store_true",
+                        help="write the result as JSON")
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Run a DT Survey Analytics command without prompts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", parents=[output],
+                        help="list the respondents") \
+        .set_defaults(handler=list_command)
+    read = commands.add_parser("read", parents=[output],
+                               help="read a respondent's scores")
+    read.add_argument("name")
+    read.set_defaults(handler=read_command)
+    read_question = commands.add_parser(
+        "read-q", parents=[output],
+        help="read every response to a question")
+    read_question.add_argument("question", type=int)
+    read_question.set_defaults(handler=read_question_command)
+    commands.add_parser("read-all", parents=[output],
+                        help="read all survey data") \
+        .set_defaults(handler=read_all_command)
+    commands.add_parser("analyse", parents=[output],
+                        help="analyse the whole survey") \
+        .set_defaults(handler=analyse_command)
+    add = commands.add_parser("add", parents=[output],
+                              help="add a new respondent")
+    add.add_argument("name")
+    add.add_argument("scores", nargs="+")
+    add.set_defaults(handler=add_command)
+    import_file = commands.add_parser(
+        "import", parents=[output],
+        help="add respondents in bulk from a CSV file")
+    import_file.add_argument("path")
+    import_file.set_defaults(handler=import_command)
+    export = commands.add_parser(
+        "export", parents=[output],
+        help="write survey data and statistics to local files")
+    export.add_argument("directory", nargs="?",
+                        default=survey_io.EXPORT_DIRECTORY)
+    export.set_defaults(handler=export_command)
+    segment = commands.add_parser(
+        "segment", parents=[output],
+        help="break the results down by a respondent attribute")
+    segment.add_argument("attribute")
+    segment.set_defaults(handler=segment_command)
+    correlate = commands.add_parser(
+        "correlate", parents=[output],
+        help="list the most strongly correlated pairs of questions")
+    correlate.add_argument("--method", default="pearson",
+                           choices=analytics.CORRELATION_METHODS)
+    correlate.add_argument("--top", type=int, default=10,
+                           help="number of pairs to list")
+    correlate.add_argument("--matrix", action="store_true",
+                           help="include the full correlation matrix")
+    correlate.set_defaults(handler=correlate_command)
+    close_round = commands.add_parser(
+        "close-round", parents=[output],
+        help="save the current round of the survey")
+    close_round.add_argument("name")
+    close_round.add_argument("--clear", action="store_true",
+                             help="delete the responses after saving them")
+    close_round.set_defaults(handler=close_round_command)
+    commands.add_parser("trend", parents=[output],
+                        help="compare the results of each round") \
+        .set_defaults(handler=trend_command)
+    return parser
+
+
+def main(argv=None, out=None):
+    """
+    Parses the arguments, runs the command and writes its result (to stdout
+    unless another stream is given). Returns the exit status.
+    """
+    out = out or sys.stdout
+    args = build_parser().parse_args(argv)
+    try:
+        tracing.TRACER.begin_command(args.command)
+        run.SNAPSHOT.refresh()
+        if args.command in ADMIN_COMMANDS:
+            check_password()
+        result = args.handler(args)
+        if args.json:
+            write_json(result, out)
+        else:
+            write_plain(result, out)
+        # streamed results (e.g. read-all) are read while they are written
+        tracing.TRACER.end_command()
+    except (CommandError, OSError, gspread.exceptions.APIError,
+            requests.exceptions.RequestException) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
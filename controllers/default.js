@@ -1,51 +1,112 @@
-const Pty = require('node-pty');
+const Child = require('child_process');
+const net = require('net');
 const fs = require('fs');
 
+// One Python service (service.py) runs the application for every terminal
+const SERVICE_SOCKET = process.env.SURVEY_SERVICE_SOCKET || 'survey_service.sock';
+const CONNECT_RETRIES = 20;
+const CONNECT_DELAY = 500;
+
 exports.install = function () {
 
     ROUTE('/');
     WEBSOCKET('/', socket, ['raw']);
 
+    startService();
+
 };
 
-function socket() {
+function startService() {
 
-    this.encodedecode = false;
-    this.autodestroy();
+    const service = Child.spawn('python3', ['service.py'], {
+        cwd: process.env.PWD,
+        env: Object.assign({}, process.env, { SURVEY_SERVICE_SOCKET: SERVICE_SOCKET }),
+        stdio: ['ignore', 'inherit', 'inherit']
+    });
 
-    this.on('open', function (client) {
+    service.on('exit', function (code, signal) {
+        console.log("Survey service stopped, restarting");
+        setTimeout(startService, CONNECT_DELAY);
+    });
+}
+
+function connectService(client, attempt) {
+
+    const connection = net.createConnection(SERVICE_SOCKET);
+    // decodes across chunks, so a character split between two is kept whole
+    connection.setEncoding('utf8');
+
+    connection.on('connect', function () {
+        client.service = connection;
+        client.line = '';
+    });
+
+    connection.on('error', function (err) {
+        // the service may still be starting
+        if (!client.service && !client.closed && attempt < CONNECT_RETRIES) {
+            setTimeout(function () {
+                connectService(client, attempt + 1);
+            }, CONNECT_DELAY);
+        } else if (!client.service) {
+            client.send("Could not reach the survey service.\r\n");
+            client.close();
+        }
+    });
+
+    connection.on('data', function (data) {
+        client.send(data);
+    });
 
-        // Spawn terminal
-        client.tty = Pty.spawn('python3', ['run.py'], {
-            name: 'xterm-color',
-            cols: 80,
-            rows: 24,
-            cwd: process.env.PWD,
-            env: process.env
-        });
-
-        client.tty.on('exit', function (code, signal) {
-            client.tty = null;
+    connection.on('close', function () {
+        if (client.service === connection) {
+            client.service = null;
             client.close();
-            console.log("Process killed");
-        });
+            console.log("Session ended");
+        }
+    });
+}
 
-        client.tty.on('data', function (data) {
-            client.send(data);
-        });
+function socket() {
 
+    this.encodedecode = false;
+    this.autodestroy();
+
+    this.on('open', function (client) {
+        connectService(client, 0);
     });
 
     this.on('close', function (client) {
-        if (client.tty) {
-            client.tty.kill(9);
-            client.tty = null;
-            console.log("Process killed and terminal unloaded");
+        client.closed = true;
+        if (client.service) {
+            client.service.end();
+            client.service = null;
+            console.log("Session closed and terminal unloaded");
         }
     });
 
+    // The service reads whole lines, so keystrokes are echoed and edited
+    // here as a terminal would before each line is sent
     this.on('message', function (client, msg) {
-        client.tty && client.tty.write(msg);
+        if (!client.service) {
+            return;
+        }
+        for (const key of msg.toString()) {
+            if (key === '\r' || key === '\n') {
+                client.send('\r\n');
+                client.service.write(client.line + '\n');
+                client.line = '';
+            } else if (key === '\x7f' || key === '\b') {
+                if (client.line.length) {
+                    client.line = client.line.slice(0, -1);
+                    client.send('\b \b');
+                }
+            } else if (key === '\x03' || key === '\x04') {
+                client.service.end();
+            } else if (key >= ' ') {
+                client.line += key;
+                client.send(key);
+            }
+        }
     });
 }
 
@@ -57,4 +118,4 @@ if (process.env.CREDS != null) {
             socket.emit("console_output", "Error saving credentials: " + err);
         }
     });
-}
\ No newline at end of file
+}
@@ -0,0 +1,193 @@
+"""
+Survey rounds: stored snapshots of past rounds and trend reporting.
+
+Each round of the survey is collected in the same worksheet. When a round
+is closed, close_round() saves a compact snapshot of it to a file in the
+rounds directory (SURVEY_ROUNDS_DIRECTORY, default "survey_rounds"): a
+NumPy .npz archive holding
+
+- the round's name, the time it was closed and its sequence number (one
+  more than the latest round saved before it), which orders the rounds
+- the respondent names and the score matrix (int8, 0 marking a blank or
+  invalid response, as analytics.parse_rows())
+- each question's summary and full text, and the key it is matched on
+- the per-question score histograms (see analytics.RunningAggregates)
+
+The trend report compares rounds using the stored histograms alone. The
+arrays of an archive are read individually and on demand, so the names and
+scores of old rounds are never loaded for it, and nothing is downloaded
+from the sheet for them.
+
+Adding or deleting a question renumbers the questions after it, so
+questions are matched between rounds by their text without the number (see
+question_key()) rather than by position.
+"""
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+
+import analytics
+
+ROUNDS_DIRECTORY = os.environ.get("SURVEY_ROUNDS_DIRECTORY",
+                                  "survey_rounds")
+# Label of the round still being collected in the worksheet
+CURRENT_ROUND = "Current"
+
+
+def question_key(question):
+    """
+    Returns the key a question is matched on between rounds: its text
+    without the "Q<number> - " prefix, in lower case.
+    """
+    return re.sub(r"^Q\d+\s*-\s*", "", question.strip()).lower()
+
+
+def question_keys(summaries, full_questions):
+    """
+    Returns the key of each question, taken from its full text, or from its
+    summary if it has no full text.
+    """
+    keys = []
+    for index, summary in enumerate(summaries):
+        full_question = full_questions[index] \
+            if index < len(full_questions) else ""
+        keys.append(question_key(full_question or summary))
+    return keys
+
+
+def is_reserved_name(name):
+    """
+    Returns True if a round may not be given the name, because it is the
+    label of the current round in trend reports.
+    """
+    return name.strip().lower() == CURRENT_ROUND.lower()
+
+
+def round_path(name, directory=ROUNDS_DIRECTORY):
+    """
+    Returns the path of the file a round with the given name is saved to.
+    """
+    slug = re.sub(r"[^a-z0-9]+", "-", name.strip().lower()).strip("-")
+    return os.path.join(directory, f"{slug or 'round'}.npz")
+
+
+def close_round(survey_snapshot, full_questions, name,
+                directory=ROUNDS_DIRECTORY):
+    """
+    Saves the survey held by the snapshot (see snapshot.py), with the given
+    full question texts, as the round of the given name. Returns the path
+    of the file written. Raises ValueError if the name is reserved (see
+    is_reserved_name()) and FileExistsError if a round of the same name has
+    already been saved.
+    """
+    if is_reserved_name(name):
+        raise ValueError(f"A round cannot be named '{CURRENT_ROUND}'.")
+    path = round_path(name, directory)
+    if os.path.exists(path):
+        raise FileExistsError(f"A round named '{name}' has already been "
+                              f"saved ({path}).")
+    os.makedirs(directory, exist_ok=True)
+    survey_scores = survey_snapshot.scores()
+    summaries = survey_scores.questions
+    full_questions = [full_questions[index]
+                      if index < len(full_questions) else ""
+                      for index in range(len(summaries))]
+    aggregates = analytics.RunningAggregates.from_scores(survey_scores)
+    sequence = max((stored.sequence for stored in load_rounds(directory)),
+                   default=0) + 1
+    # written under a temporary name first, so an interrupted save does not
+    # leave a partial round behind
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as round_file:
+        np.savez_compressed(
+            round_file,
+            name=np.array(name.strip()),
+            closed=np.array(datetime.now().isoformat(timespec="seconds")),
+            sequence=np.array(sequence),
+            names=np.array(survey_scores.names, dtype=str),
+            scores=survey_scores.matrix,
+            summaries=np.array(summaries, dtype=str),
+            questions=np.array(full_questions, dtype=str),
+            keys=np.array(question_keys(summaries, full_questions),
+                          dtype=str),
+            histograms=aggregates.histograms,
+            respondent_count=np.array(aggregates.respondent_count))
+    os.replace(temporary_path, path)
+    return path
+
+
+class StoredRound:
+    """
+    The summary of a round used in trend reports: its name, when it was
+    closed and its sequence number, its question keys and summaries and its
+    aggregates.
+    """
+
+    def __init__(self, name, closed, sequence, keys, summaries, aggregates):
+        self.name = name
+        self.closed = closed
+        self.sequence = sequence
+        self.keys = keys
+        self.summaries = summaries
+        self.aggregates = aggregates
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a round's summary from its file, leaving out its names and
+        scores. Rounds saved before sequence numbers were stored are given
+        0, so they come before every later round.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            aggregates = analytics.RunningAggregates(
+                data["histograms"], int(data["respondent_count"]))
+            sequence = int(data["sequence"]) if "sequence" in data.files \
+                else 0
+            return cls(str(data["name"]), str(data["closed"]), sequence,
+                       data["keys"].tolist(), data["summaries"].tolist(),
+                       aggregates)
+
+
+def load_rounds(directory=ROUNDS_DIRECTORY):
+    """
+    Returns the summary of every saved round, oldest first. Rounds are
+    ordered by sequence number, then by the time they were closed, which
+    is stored only to the second.
+    """
+    if not os.path.isdir(directory):
+        return []
+    stored_rounds = [StoredRound.load(os.path.join(directory, file_name))
+                     for file_name in os.listdir(directory)
+                     if file_name.endswith(".npz")]
+    return sorted(stored_rounds,
+                  key=lambda stored: (stored.sequence, stored.closed))
+
+
+def trend_questions(survey_rounds):
+    """
+    Returns the key and summary of every question asked in any of the
+    rounds, in the order of the latest round to ask them, followed by
+    those only asked in earlier rounds. The summary is the latest one.
+    """
+    questions = {}
+    for survey_round in reversed(survey_rounds):
+        for key, summary in zip(survey_round.keys, survey_round.summaries):
+            questions.setdefault(key, summary)
+    return list(questions.items())
+
+
+def question_trend(survey_rounds, key):
+    """
+    Returns, for each round, the aggregates of the question with the given
+    key and its index within them, or None if it was not asked that round.
+    """
+    trend = []
+    for survey_round in survey_rounds:
+        if key in survey_round.keys:
+            trend.append((survey_round.aggregates,
+                          survey_round.keys.index(key)))
+        else:
+            trend.append(None)
+    return trend
@@ -1,20 +1,51 @@
-import gspread
+import csv
+import math
+import os
 import statistics
+
+import gspread
+import requests
+from gspread.utils import rowcol_to_a1
 from termcolor import colored
 
-from google.oauth2.service_account import Credentials
+import analytics
+import rounds
+import snapshot
+import storage
+import survey_io
+import tracing
 
-SCOPE = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive"
-    ]
+# The survey worksheet - either the live Google Sheet or a local stand-in,
+# depending on the SURVEY_BACKEND environment variable (see storage.py).
+# The connection is only made when the survey is first used.
+SURVEY = storage.LazyWorksheet()
+# Cached copy of the survey values, fetched at most once per command and
+# invalidated after every write (see snapshot.py)
+SNAPSHOT = snapshot.SurveySnapshot(SURVEY, storage.NOTES_CACHE_FILE)
+# The independent reads each command needs, fetched in parallel at its
+# start (see SurveySnapshot.prefetch)
+COMMAND_READS = {
+    'add': ("names", "notes"),
+    'update': ("grid", "notes"),
+    'read': ("grid",),
+    'read q': ("grid", "notes"),
+    'add q': ("headings", "notes"),
+    'delete q': ("headings", "notes"),
+    'read all': ("names", "notes"),
+    'analyse': ("grid",),
+    'import': ("names", "headings"),
+    'export': ("names", "headings", "notes"),
+    'segment': ("grid", "attributes"),
+    'correlate': ("grid",),
+    'close round': ("grid", "notes"),
+    'trend': ("headings", "notes"),
+    }
 
-CREDS = Credentials.from_service_account_file("creds.json")
-SCOPED_CREDS = CREDS.with_scopes(SCOPE)
-GSPREAD_CLIENT = gspread.authorize(SCOPED_CREDS)
-SHEET = GSPREAD_CLIENT.open("DT_survey_analytics")
-SURVEY = SHEET.worksheet("survey_results")
+
+class ReturnHome(Exception):
+    """
+    Raised to abandon the current command and return to the main menu.
+    """
 
 
 def get_user_type():
@@ -40,7 +71,7 @@ def get_user_type():
             quit()
         elif user_type == "home":
             print("\n")
-            main()
+            continue
         validated_user_type = validate_command(user_type, "user type")
         if validated_user_type is True:
             return user_type
@@ -55,7 +86,8 @@ def validate_password():
     enter the admin password, which is contained in the note of the first
     cell (A1) of the survey spreadsheet.
     """
-    admin_password = SURVEY.get_note('A1')
+    SNAPSHOT.refresh()
+    admin_password = SNAPSHOT.admin_password()
     response = input("Please enter the administrator password:\n")
     main_menu_check(response)
     if response == admin_password:
@@ -65,7 +97,7 @@ def validate_password():
     else:
         print(colored("Password invalid. Returning to main menu...\n",
                       "yellow"))
-        main()
+        raise ReturnHome()
 
 
 def process_main_command(user_type):
@@ -82,6 +114,12 @@ def process_main_command(user_type):
     - 'delete q' deletes an exiting question within the survey
     - 'read all' returns a list of all questions, names and response values
     - 'analyse' returns general analysis over all survey data
+    - 'import' adds respondents in bulk from a CSV file
+    - 'export' writes survey data and statistics to local files
+    - 'segment' breaks the results down by a respondent attribute
+    - 'correlate' lists the pairs of questions whose scores move together
+    - 'close round' saves the current round of the survey
+    - 'trend' compares the results of each round of the survey
     - 'exit' exits the program
     Admin level users have access to all functions.
     Respondent level users can only access 'add', 'update' and 'exit'.
@@ -110,6 +148,18 @@ def process_main_command(user_type):
                   "summary of all survey data")
             print("- " + colored("'analyse'", 'light_cyan') + " to conduct "
                   "general analysis over all survey data")
+            print("- " + colored("'import'", 'light_cyan') + " to add "
+                  "respondents in bulk from a CSV file")
+            print("- " + colored("'export'", 'light_cyan') + " to write "
+                  "survey data and statistics to local files")
+            print("- " + colored("'segment'", 'light_cyan') + " to break "
+                  "the results down by department, site or other attribute")
+            print("- " + colored("'correlate'", 'light_cyan') + " to find "
+                  "the questions whose scores move together")
+            print("- " + colored("'close round'", 'light_cyan') + " to save "
+                  "the current round of the survey")
+            print("- " + colored("'trend'", 'light_cyan') + " to compare "
+                  "the results of each round of the survey")
             print("- " + colored("'exit'", 'light_cyan') + " to exit the "
                   "application\n")
             main_command = input("Enter your command here:\n")
@@ -172,7 +222,9 @@ def validate_command(command, menu):
     print(colored("Validating command...", "yellow"))
     main_admin_command_list = ['add', 'update', 'delete', 'list', 'read',
                                'add q', 'read q', 'delete q', 'read all',
-                               'analyse', 'exit', 'home']
+                               'analyse', 'import', 'export', 'segment',
+                               'correlate', 'close round', 'trend',
+                               'exit', 'home']
     main_respondent_command_list = ['add', 'update', 'delete', 'exit', 'home']
     update_command_list = ['one', 'all', 'home']
     user_type_list = ['admin', 'respondent', 'exit', 'home']
@@ -206,11 +258,11 @@ def validate_command(command, menu):
 def main_menu_check(user_input):
     """
     If the user has entered "home" into any input field, return to the
-    main menu.
+    main menu by raising ReturnHome, which unwinds to the loop in main().
     """
     if user_input == "home":
         print(colored("Returning to main menu...\n", "yellow"))
-        main()
+        raise ReturnHome()
 
 
 def get_respondent_name(main_command, user_type):
@@ -251,11 +303,11 @@ def get_respondent_name(main_command, user_type):
 
 def list_respondents():
     """
-    Reads the first column of data from the spreadsheet. Removes heading
-    ("Name"). Prints the list of names with a corresponding counter.
+    Reads the list of respondent names (the first column of the spreadsheet,
+    without the "Name" heading) from the name index. Prints the list of names
+    with a corresponding counter.
     """
-    respondent_column = SHEET.worksheet("survey_results").col_values(1)
-    respondent_names = respondent_column[1:]
+    respondent_names = SNAPSHOT.respondent_names()
     print(get_border())
     print(colored("RESPONDENT LIST\n", 'green', attrs=['bold']))
     respondent_number = 1
@@ -305,6 +357,7 @@ def update_survey_sheet(new_data):
     """
     print(colored("Updating survey results spreadsheet...\n", "yellow"))
     SURVEY.append_row(new_data)
+    SNAPSHOT.respondent_added(new_data[0], new_data[1:])
     print(colored("Update complete!\n", "yellow"))
 
 
@@ -315,8 +368,7 @@ def validate_name(name):
     match is detected, then the valid name is passedback to the main function.
     """
     print(colored("Validating name...\n", "yellow"))
-    existing_names = SURVEY.col_values(1)
-    while name not in existing_names:
+    while SNAPSHOT.respondent_row(name) is None:
         name = input("The name you entered does not exist. Please submit the "
                      "name of a respondent who has completed the survey.\n")
         main_menu_check(name)
@@ -362,9 +414,7 @@ def check_existing_names(name):
     """
     main_menu_check(name)
     print(colored("Checking existing names...\n", "yellow"))
-    existing_names = SURVEY.col_values(1)
-    existing_names.pop(0)  # removes "Name" column header from list
-    while name in existing_names:
+    while SNAPSHOT.respondent_row(name) is not None:
         print(colored("The name you entered already exists - you have already "
               "completed the survey!\n", "yellow"))
         name = input("Please enter the name of a new respondent.\n")
@@ -379,8 +429,7 @@ def read_respondent_data(name):
     returned as a list of scores.
     """
     print(colored(f"Reading {name}'s data...\n", "yellow"))
-    name_cell = SURVEY.find(name)
-    respondent_scores = SURVEY.row_values(name_cell.row)
+    respondent_scores = SNAPSHOT.row_values(SNAPSHOT.respondent_row(name))
     return respondent_scores
 
 
@@ -388,9 +437,9 @@ def read_question_data(question_number):
     """
     Outputs a list of respondent names and their scores for a given question.
     """
-    existing_names = SURVEY.col_values(1)
+    existing_names = SNAPSHOT.col_values(1)
     existing_names.pop(0)  # removes "Name" column header from list
-    responses = SURVEY.col_values(question_number + 1)
+    responses = SNAPSHOT.col_values(question_number + 1)
     # The first item in responses will be the column heading i.e. summarised Q
     summarised_question = responses.pop(0)
     # gets length of the longest name in the list to help with spacing output
@@ -398,21 +447,23 @@ def read_question_data(question_number):
     print(get_border())
     print(colored(f"LISTING RESULTS FOR {summarised_question}:\n", 'green',
                   attrs=['bold']))
-    name_index = 0
     print(colored("NAME", "green").ljust(longest_name+12)+colored("SCORE",
                                                                   "green"))
-    for response in responses:
+    for name_index, name in enumerate(existing_names):
+        # col_values() leaves out the blank cells at the end of the column
+        response = responses[name_index] \
+            if name_index < len(responses) else ""
         #  prints name & score for each respondent, spaced with .ljust method
-        print(f"{existing_names[name_index].ljust(longest_name+5)}{response}")
-        name_index += 1
-    survey_data = SURVEY.get_all_values()
-    survey_averages = get_averages(survey_data, "False")
-    float_averages = [float(avg) for avg in survey_averages]
-    float_responses = [float(response) for response in responses]
-    organisation_average = round(statistics.mean(float_averages), 1)
-    question_average = round(statistics.mean(float_responses), 1)
+        print(f"{name.ljust(longest_name+5)}{response}")
+    survey_aggregates = SNAPSHOT.aggregates()
+    organisation_average = mean_of_averages(
+        get_averages(survey_aggregates, False))
+    question_average = round(
+        float(survey_aggregates.question_means()[question_number - 1]), 1)
     print(get_border())
-    if question_average > organisation_average + 0.4:
+    if math.isnan(question_average):
+        print("There are no valid responses to this question yet.")
+    elif question_average > organisation_average + 0.4:
         print(f"The average score for this question was {question_average}, "
               f"which is higher than the average\nscore across all questions "
               f"({organisation_average}).")
@@ -425,6 +476,8 @@ def read_question_data(question_number):
               f"which is close to the average\nscore across all questions "
               f"({organisation_average}).")
     print(get_border())
+    print_question_distribution(survey_aggregates, question_number - 1)
+    print(get_border())
     print(colored("Analysis complete. Returning to main menu...\n", "yellow"))
 
 
@@ -435,21 +488,28 @@ def analyse_respondent_data(respondent_data):
     for the given individual.
     """
     print(colored("Analysing data...\n", "yellow"))
-    # removes the name from the row, leaving just the scores
-    respondent_name = respondent_data.pop(0)
+    respondent_name = respondent_data[0]
     print(colored(f"Results for {respondent_name} are as follows:\n",
                   "yellow"))
     summarised_questions = get_questions("summarised")
-    # converts scores to integers so that numerical analysis can be performed
-    converted_scores = [int(x) for x in respondent_data]
-    # calculates the mean score from the list rounded to 1 decimal
-    average_score = round(statistics.mean(converted_scores), 1)
-    # calculates the variance from the list rounded to 1 decimal place
-    score_variance = round(statistics.variance(converted_scores), 1)
-    survey_data = SURVEY.get_all_values()
-    survey_averages = get_averages(survey_data, "False")
-    float_averages = [float(x) for x in survey_averages]
-    organisation_average = round(statistics.mean(float_averages), 1)
+    # the respondent's statistics come from their row of the score matrix
+    # (the first respondent is on row 2 of the sheet, row 0 of the matrix)
+    survey_scores = SNAPSHOT.scores()
+    respondent_index = SNAPSHOT.respondent_row(respondent_name) - 2
+    respondent_summary = survey_scores.respondent_summary(respondent_index)
+    converted_scores = survey_scores.matrix[respondent_index].tolist()
+    if respondent_summary["min"] == analytics.INVALID:
+        print(get_border())
+        print(f"{respondent_name} has not given any valid responses yet.")
+        print(get_border())
+        print(colored("Analysis complete. Returning to main menu...\n",
+                      "yellow"))
+        return
+    # mean score and variance, each rounded to 1 decimal place
+    average_score = round(respondent_summary["mean"], 1)
+    score_variance = round(respondent_summary["variance"], 1)
+    survey_averages = get_averages(SNAPSHOT.aggregates(), False)
+    organisation_average = mean_of_averages(survey_averages)
     # Sets output strings based on variance level
     if score_variance > 2:
         variance_string = "high level of variance, indicating significant " \
@@ -479,14 +539,16 @@ def analyse_respondent_data(respondent_data):
     print(get_border())
     print(colored("QUESTION".ljust(32) + "SCORE".ljust(8) + "COMPARISON WITH "
                   "ORGANISATION", 'green', attrs=['bold']))
-    question_index = 0
     # Prints a table of individual scores and comparisons to organisation
-    for score in respondent_data:
-        if float(score) < (float(survey_averages[question_index]) - 0.4):
+    for question_index, score in enumerate(converted_scores):
+        if score == analytics.INVALID:
+            print(f"{summarised_questions[question_index].ljust(32)}  - "
+                  f"    Blank or invalid response")
+        elif score < (float(survey_averages[question_index]) - 0.4):
             print(f"{summarised_questions[question_index].ljust(32)}  {score} "
                   f"    Lower than organisation average "
                   f"({survey_averages[question_index]})")
-        elif float(score) > (float(survey_averages[question_index]) + 0.4):
+        elif score > (float(survey_averages[question_index]) + 0.4):
             print(f"{summarised_questions[question_index].ljust(32)}  {score} "
                   f"    Higher than organisation average "
                   f"({survey_averages[question_index]})")
@@ -494,15 +556,14 @@ def analyse_respondent_data(respondent_data):
             print(f"{summarised_questions[question_index].ljust(32)}  {score} "
                   f"    Close to the organisation average "
                   f"({survey_averages[question_index]})")
-        question_index += 1
     print(get_border())
-    min_score = min(converted_scores)
-    max_score = max(converted_scores)
+    min_score = respondent_summary["min"]
+    max_score = respondent_summary["max"]
     lowest_scored_questions = []
     highest_scored_questions = []
     count_index = 0
     # Adds questions the person scored lowest and highest to separate lists
-    while count_index < SURVEY.col_count - 1:
+    while count_index < survey_scores.question_count:
         if converted_scores[count_index] == min_score:
             lowest_scored_questions.append(
                 summarised_questions[count_index])
@@ -510,6 +571,9 @@ def analyse_respondent_data(respondent_data):
             highest_scored_questions.append(
                 summarised_questions[count_index])
         count_index += 1
+    print_percentile_ranks(SNAPSHOT.aggregates(), summarised_questions,
+                           converted_scores)
+    print(get_border())
     print(colored('HIGHLIGHTS', 'green', attrs=['bold']))
     print(f"Highest scored question(s) scored {max_score} as follows: ")
     [print(question) for question in highest_scored_questions]
@@ -529,12 +593,15 @@ def update_data(name_to_update, update_command):
     or row of cells before returning to the main menu.
     """
     print(colored("Updating data...\n", "yellow"))
-    name_cell = SURVEY.find(name_to_update)
-    row_to_update = name_cell.row
+    row_to_update = SNAPSHOT.respondent_row(name_to_update)
+    current_responses = read_respondent_data(name_to_update)[1:]
+    # row_values() leaves out the trailing blank cells of the row
+    question_count = len(SNAPSHOT.headings()) - 1
+    current_responses += [""] * (question_count - len(current_responses))
     while True:
         try:
             confirm = input(f"{name_to_update}'s responses are currently:\n"
-                            f"{read_respondent_data(name_to_update)[1:]}.\n"
+                            f"{current_responses}.\n"
                             "Are you sure you wish to amend this data? "
                             "(Y/N):\n")
             main_menu_check(confirm)
@@ -543,7 +610,7 @@ def update_data(name_to_update, update_command):
             elif confirm in ["N", "n"]:
                 print(colored("Update aborted. Returning to main menu.\n",
                               "yellow"))
-                main()
+                raise ReturnHome()
             else:
                 print(colored("Please respond with 'Y' to proceed or 'N' to "
                               "cancel."))
@@ -555,11 +622,14 @@ def update_data(name_to_update, update_command):
         print(colored(f"Value responses {update_data_list} will now "
                       f"be\nupdated for {name_to_update}...", "yellow"))
         # The values start from the 2nd column onwards and .update_cell method
-        # is 1-indexed, so the loop index must start at 2 to insert correctly
+        # is 1-indexed, so the loop index must start at 2 to insert correctly.
+        # The cells are collected and written in a single batch request.
         column_index = 2
-        for update_value in update_data_list:
-            SURVEY.update_cell(row_to_update, column_index, update_value)
-            column_index += 1
+        with storage.WriteBatch(SURVEY) as batch:
+            for update_value in update_data_list:
+                batch.update_cell(row_to_update, column_index, update_value)
+                column_index += 1
+        SNAPSHOT.responses_updated(current_responses, update_data_list)
         print(colored("Update complete. Returning to main menu...\n",
                       "yellow"))
     elif update_command == 'one':
@@ -590,6 +660,10 @@ def update_data(name_to_update, update_command):
                                   f"{name_to_update}...", "yellow"))
                     SURVEY.update_cell(row_to_update, int_question_number + 1,
                                        int(update_value))
+                    updated_responses = list(current_responses)
+                    updated_responses[int_question_number - 1] = update_value
+                    SNAPSHOT.responses_updated(current_responses,
+                                               updated_responses)
                     print(colored("Update complete. Returning to main menu... "
                                   "\n", "yellow"))
                     return
@@ -601,10 +675,455 @@ def update_data(name_to_update, update_command):
                               "valid value.", "yellow"))
 
 
+def import_respondents():
+    """
+    Requests the path of a CSV file of respondents (name followed by one score
+    per question on each line). Validates every line against the current
+    questions and existing names, reports the rejected lines, and after
+    confirmation appends the accepted respondents in batches.
+    """
+    print(colored("Importing respondents...\n", "yellow"))
+    questions = get_questions("summarised")
+    print(f"Each line of the file should hold the respondent's name followed "
+          f"by their {len(questions)}\nscores (1 to 5) in question order:")
+    print(", ".join(["Name"] + questions) + "\n")
+    path = input("Please enter the path of the CSV file to import:\n")
+    main_menu_check(path)
+    try:
+        rows, rejected = survey_io.read_import_file(
+            path, len(questions), SNAPSHOT.respondent_names())
+    except (OSError, UnicodeDecodeError, csv.Error) as error:
+        print(colored(f"The file could not be read ({error}). Returning to "
+                      "main menu...\n", "yellow"))
+        return
+    if rejected:
+        print(colored(f"{len(rejected)} line(s) will not be imported:",
+                      "yellow"))
+        for line_number, reason in rejected:
+            print(f"Line {line_number}: {reason}")
+        print("")
+    if not rows:
+        print(colored("There are no valid respondents to import. Returning "
+                      "to main menu...\n", "yellow"))
+        return
+    while True:
+        confirm = input(f"{len(rows)} respondent(s) are ready to import. "
+                        "Are you sure you wish to add them? (Y/N):\n")
+        main_menu_check(confirm)
+        if confirm in ["Y", "y"]:
+            break
+        elif confirm in ["N", "n"]:
+            print(colored("Import aborted. Returning to main menu.\n",
+                          "yellow"))
+            raise ReturnHome()
+        else:
+            print(colored("Please respond with 'Y' to proceed or 'N' to "
+                          "cancel.", "yellow"))
+    imported = 0
+    for batch in survey_io.append_in_batches(SURVEY, rows):
+        SNAPSHOT.respondents_added(batch)
+        imported += len(batch)
+        print(colored(f"{imported} of {len(rows)} respondents added...",
+                      "yellow"))
+    print(colored("Import complete. Returning to main menu...\n", "yellow"))
+
+
+def export_survey_data():
+    """
+    Requests a directory and writes the survey data, question metadata and
+    per-question and per-respondent statistics to files within it (see
+    survey_io.py).
+    """
+    directory = input(f"Please enter the directory to export to, or press "
+                      f"Enter to use '{survey_io.EXPORT_DIRECTORY}':\n")
+    main_menu_check(directory)
+    directory = directory or survey_io.EXPORT_DIRECTORY
+    print(colored("Exporting survey data...\n", "yellow"))
+    try:
+        exported = survey_io.export_survey(SNAPSHOT, get_questions("full"),
+                                           directory)
+    except OSError as error:
+        print(colored(f"The export could not be written ({error}). "
+                      "Returning to main menu...\n", "yellow"))
+        return
+    print(colored(f"{exported} respondents exported to questions.csv, "
+                  f"responses.csv and scores.npy in '{directory}'.",
+                  "yellow"))
+    print(colored("Export complete. Returning to main menu...\n", "yellow"))
+
+
+def get_attribute():
+    """
+    Lists the respondent attributes held for the survey and requests the one
+    to break the results down by. Returns the attribute's name, or None if
+    the survey has no attributes.
+    """
+    attribute_names = SNAPSHOT.attributes()[0]
+    if not attribute_names:
+        print(colored(f"No respondent attributes were found. To break the "
+                      f"results down, add a\nworksheet named "
+                      f"'{storage.ATTRIBUTES_WORKSHEET_NAME}' with a 'Name' "
+                      f"column and a column for\neach attribute (e.g. "
+                      f"department, site or tenure). Returning to main "
+                      f"menu...\n", "yellow"))
+        return None
+    print("Respondent attributes:")
+    for attribute in attribute_names:
+        print(f"- {attribute}")
+    while True:
+        attribute = input("\nWhich attribute would you like to break the "
+                          "results down by?:\n")
+        main_menu_check(attribute)
+        print(colored("Validating attribute...", "yellow"))
+        for attribute_name in attribute_names:
+            if attribute.strip().lower() == attribute_name.strip().lower():
+                print(colored("Validated.\n", "yellow"))
+                return attribute_name
+        print(colored("Invalid attribute. Please enter an attribute from the "
+                      "list provided.", "yellow"))
+
+
+def analyse_segments():
+    """
+    Breaks the survey results down by a respondent attribute, outputting
+    each segment's average score and, for each question, its average and
+    percentage of favourable scores compared with the organisation. To keep
+    respondents anonymous, segments with fewer than
+    analytics.MIN_SEGMENT_SIZE respondents are not shown, along with the next
+    smallest segment where needed (see analytics.SegmentedAggregates).
+    """
+    attribute = get_attribute()
+    if attribute is None:
+        return
+    print(colored(f"Analysing survey data by {attribute}...\n", "yellow"))
+    segmented = get_segments(attribute)
+    survey_aggregates = SNAPSHOT.aggregates()
+    organisation_average = round(survey_aggregates.overall_mean(), 1)
+    question_averages = [round(float(average), 1) for average
+                         in survey_aggregates.question_means()]
+    summarised_questions = get_questions("summarised")
+    for label, segment in segmented.reportable().items():
+        print_segment(label, segment, organisation_average,
+                      question_averages, summarised_questions)
+    suppressed = segmented.suppressed()
+    print(get_border())
+    if suppressed:
+        print(f"Segments with fewer than {analytics.MIN_SEGMENT_SIZE} "
+              f"respondents are not shown, to keep their\nresponses "
+              f"anonymous. Where these hold fewer than "
+              f"{analytics.MIN_SEGMENT_SIZE} respondents in\nall, the next "
+              f"smallest segment is not shown either, so that theirs cannot "
+              f"be\nworked out from the organisation's results:")
+        for label in suppressed:
+            print(label)
+        print(get_border())
+    print(colored("Analysis complete. Returning to main menu...\n", "yellow"))
+
+
+def get_segments(attribute):
+    """
+    Groups the respondents by their value of the given attribute, taken from
+    the attributes worksheet by name. Respondents with no value are grouped
+    as analytics.NOT_RECORDED.
+    """
+    attribute_names, respondent_attributes = SNAPSHOT.attributes()
+    column = attribute_names.index(attribute)
+    survey_scores = SNAPSHOT.scores()
+    labels = []
+    for name in survey_scores.names:
+        values = respondent_attributes.get(name.strip(), [])
+        value = values[column].strip() if column < len(values) else ""
+        labels.append(value or analytics.NOT_RECORDED)
+    return analytics.SegmentedAggregates.group(survey_scores, attribute,
+                                               labels)
+
+
+def print_segment(label, segment, organisation_average, question_averages,
+                  summarised_questions):
+    """
+    Outputs one segment's results compared with the organisation's, in the
+    same way as a respondent's results are compared by 'read'.
+    """
+    print(get_border())
+    print(colored(f"{label.upper()} ({segment.respondent_count} "
+                  f"respondents)", 'green', attrs=['bold']))
+    if int(segment.counts.sum()) == 0:
+        print("There are no valid responses in this segment.")
+        return
+    average_score = round(segment.overall_mean(), 1)
+    print(f"{label} gave an average score of {average_score} across all "
+          f"questions.")
+    if average_score > organisation_average + 0.4:
+        print(f"This is significantly higher than the overall organisation "
+              f"average score of {organisation_average}.")
+    elif average_score < organisation_average - 0.4:
+        print(f"This is significantly lower than the overall organisation "
+              f"average score of {organisation_average}.")
+    else:
+        print(f"This is close to the organisation average score of "
+              f"{organisation_average}.")
+    print("")
+    print(colored("QUESTION".ljust(32) + "MEAN".ljust(6) + "FAV".ljust(6)
+                  + "COMPARISON WITH ORGANISATION", 'green'))
+    segment_averages = segment.question_means()
+    favourable = segment.question_favourable()
+    for question_index, question in enumerate(summarised_questions):
+        organisation = question_averages[question_index]
+        if segment.counts[question_index] == 0:
+            print(f"{question.ljust(32)}-     -     No valid responses")
+            continue
+        average = round(float(segment_averages[question_index]), 1)
+        if average < organisation - 0.4:
+            comparison = f"Lower than organisation ({organisation})"
+        elif average > organisation + 0.4:
+            comparison = f"Higher than organisation ({organisation})"
+        else:
+            comparison = f"Close to organisation ({organisation})"
+        favourable_percent = \
+            f"{display_statistic(favourable[question_index], 0)}%"
+        print(f"{question.ljust(32)}{str(average).ljust(6)}"
+              f"{favourable_percent.ljust(6)}{comparison}")
+
+
+def get_correlation_method():
+    """
+    Requests the method of correlation to use, defaulting to Pearson.
+    """
+    while True:
+        method = input("Please enter " + colored("'pearson'", 'light_cyan')
+                       + " to correlate the scores or "
+                       + colored("'spearman'", 'light_cyan') + " to "
+                       "correlate\ntheir ranks, or press Enter to use "
+                       "'pearson':\n")
+        main_menu_check(method)
+        method = method.strip().lower() or "pearson"
+        if method in analytics.CORRELATION_METHODS:
+            print(colored("Validated.\n", "yellow"))
+            return method
+        print(colored("Invalid method. Please enter 'pearson' or "
+                      "'spearman'.\n", "yellow"))
+
+
+def describe_correlation(correlation):
+    """
+    Returns a description of the strength and direction of a correlation.
+    """
+    strength = abs(correlation)
+    if strength >= 0.7:
+        description = "Strong"
+    elif strength >= 0.4:
+        description = "Moderate"
+    else:
+        description = "Weak"
+    if correlation < 0:
+        description += " negative"
+    return description
+
+
+def analyse_correlations(method):
+    """
+    Correlates the scores of every pair of questions (see
+    analytics.correlation_matrix) and outputs the most strongly correlated
+    pairs, followed by the pairs of low scoring questions whose scores move
+    together, which may be best tackled together.
+    """
+    print(colored("Calculating correlations...\n", "yellow"))
+    correlations = SNAPSHOT.correlations(method)
+    pairs = analytics.strongest_pairs(correlations)
+    summarised_questions = get_questions("summarised")
+    question_averages = get_averages(SNAPSHOT.aggregates(), False)
+    print(get_border())
+    print(colored(f"STRONGEST CORRELATIONS ({method.upper()})\n", 'green',
+                  attrs=['bold']))
+    if not pairs:
+        print("There are not enough valid responses to correlate the "
+              "questions.")
+    else:
+        print(colored("QUESTIONS".ljust(48) + "R".ljust(8) + "STRENGTH",
+                      'green'))
+    # Lists the ten most strongly correlated pairs
+    for first, second, correlation in pairs[:10]:
+        questions = f"{summarised_questions[first]} & " \
+            f"{summarised_questions[second]}"
+        print(f"{questions.ljust(48)}{correlation:.2f}".ljust(56)
+              + describe_correlation(correlation))
+    print(get_border())
+    print(colored("LOW SCORING QUESTIONS WHICH MOVE TOGETHER\n", 'green',
+                  attrs=['bold']))
+    # Low scoring questions are those with an average of 2.5 or less (as in
+    # get_data_insights), paired where their correlation is 0.4 or more
+    low_scoring = [float(average) <= 2.5 for average in question_averages]
+    low_pairs = [(first, second, correlation)
+                 for first, second, correlation in pairs
+                 if low_scoring[first] and low_scoring[second]
+                 and correlation >= 0.4]
+    for first, second, correlation in low_pairs:
+        print(f"{summarised_questions[first]} & "
+              f"{summarised_questions[second]} ({correlation:.2f})")
+    if low_pairs:
+        print("\nRespondents who score one of these questions low tend to "
+              "score the other low\ntoo, so they may share a cause and be "
+              "best addressed together.")
+    else:
+        print("No two low scoring questions are correlated.")
+    print(get_border())
+    print(colored("Analysis complete. Returning to main menu...\n", "yellow"))
+
+
+def close_survey_round():
+    """
+    Requests a name for the current round of the survey and saves a
+    snapshot of it - the responses, questions and per-question aggregates -
+    for trend reports (see rounds.py). Then offers to clear the responses
+    so the next round can be collected in the same worksheet.
+    """
+    respondent_count = len(SNAPSHOT.respondent_names())
+    if respondent_count == 0:
+        print(colored("There are no responses in the current round to save. "
+                      "Returning to main menu...\n", "yellow"))
+        return
+    while True:
+        name = input("Please enter a name for the round being closed (e.g. "
+                     "'2024 Spring'):\n")
+        main_menu_check(name)
+        if not name.strip():
+            print(colored("Please enter a name for the round.\n", "yellow"))
+        elif rounds.is_reserved_name(name):
+            print(colored(f"'{rounds.CURRENT_ROUND}' is the label of the "
+                          "current round. Please enter another name.\n",
+                          "yellow"))
+        elif os.path.exists(rounds.round_path(name)):
+            print(colored(f"A round named '{name}' has already been saved. "
+                          f"Please enter another name.\n", "yellow"))
+        else:
+            break
+    print(colored("Saving round...\n", "yellow"))
+    try:
+        path = rounds.close_round(SNAPSHOT, get_questions("full"), name)
+    except OSError as error:
+        print(colored(f"The round could not be saved ({error}). Returning "
+                      "to main menu...\n", "yellow"))
+        return
+    print(colored(f"Round '{name}' saved with {respondent_count} respondents "
+                  f"to {path}.\n", "yellow"))
+    while True:
+        confirm = input("Would you like to clear the responses to start the "
+                        "next round? (Y/N):\n")
+        main_menu_check(confirm)
+        if confirm in ["Y", "y"]:
+            break
+        elif confirm in ["N", "n"]:
+            print(colored("The responses have been kept. Returning to main "
+                          "menu...\n", "yellow"))
+            return
+        else:
+            print(colored("Please respond with 'Y' to proceed or 'N' to "
+                          "cancel.", "yellow"))
+    print(colored("Clearing responses...\n", "yellow"))
+    SURVEY.delete_rows(2, respondent_count + 1)
+    SNAPSHOT.respondents_cleared()
+    print(colored("Responses cleared. The survey is ready for the next "
+                  "round.\n", "yellow"))
+
+
+def report_trends():
+    """
+    Compares the overall and per-question results of every saved round and
+    the current round, using the aggregates stored when each round was
+    closed. Questions are matched between rounds by their text, so they are
+    compared correctly even if they have been renumbered.
+    """
+    survey_rounds = get_survey_rounds()
+    if not survey_rounds:
+        print(colored("No rounds have been saved yet. Use 'close round' to "
+                      "save the current round.\nReturning to main "
+                      "menu...\n", "yellow"))
+        return
+    print(colored("Comparing survey rounds...\n", "yellow"))
+    print(get_border())
+    print(colored("OVERALL SCORE BY ROUND\n", 'green', attrs=['bold']))
+    print(colored("ROUND".ljust(24) + "RESPONDENTS".ljust(13) + "MEAN".ljust(7)
+                  + "CHANGE", 'green'))
+    previous = None
+    for survey_round in survey_rounds:
+        aggregates = survey_round.aggregates
+        mean = aggregates.overall_mean()
+        print(f"{survey_round.name[:22].ljust(24)}"
+              f"{str(aggregates.respondent_count).ljust(13)}"
+              f"{display_statistic(mean).ljust(7)}"
+              f"{describe_change(previous, mean)}")
+        previous = mean
+    for key, summary in rounds.trend_questions(survey_rounds):
+        print(get_border())
+        print_question_trend(summary, survey_rounds,
+                             rounds.question_trend(survey_rounds, key))
+    print(get_border())
+    print(colored("Trend report complete. Returning to main menu...\n",
+                  "yellow"))
+
+
+def get_survey_rounds():
+    """
+    Returns the saved rounds of the survey, oldest first, followed by the
+    current round if any have been saved and it has respondents.
+    """
+    survey_rounds = rounds.load_rounds()
+    survey_aggregates = SNAPSHOT.aggregates()
+    if survey_rounds and survey_aggregates.respondent_count > 0:
+        summarised_questions = get_questions("summarised")
+        survey_rounds.append(rounds.StoredRound(
+            rounds.CURRENT_ROUND, None, None,
+            rounds.question_keys(summarised_questions,
+                                 get_questions("full")),
+            summarised_questions, survey_aggregates))
+    return survey_rounds
+
+
+def describe_change(previous, current):
+    """
+    Returns the change from one round's mean score to the next, rounded to
+    1 decimal place, or an empty string where either is undefined.
+    """
+    if previous is None or math.isnan(previous) or math.isnan(current):
+        return ""
+    return f"{round(current, 1) - round(previous, 1):+.1f}"
+
+
+def print_question_trend(summary, survey_rounds, trend):
+    """
+    Outputs one question's number of responses, mean, median and percentage
+    of favourable scores in each round, with the change in its mean.
+    """
+    print(colored(summary, 'green', attrs=['bold']))
+    print(colored("ROUND".ljust(24) + "RESPONSES".ljust(11) + "MEAN".ljust(7)
+                  + "MEDIAN".ljust(8) + "FAV".ljust(6) + "CHANGE", 'green'))
+    previous = None
+    for survey_round, question in zip(survey_rounds, trend):
+        label = survey_round.name[:22].ljust(24)
+        if question is None:
+            print(f"{label}Not asked")
+            previous = None
+            continue
+        aggregates, index = question
+        count = int(aggregates.counts[index])
+        mean = float(aggregates.question_means()[index]) if count \
+            else math.nan
+        median = display_statistic(aggregates.question_medians()[index])
+        favourable = display_statistic(
+            aggregates.question_favourable()[index], 0)
+        if count:
+            favourable += "%"
+        print(f"{label}{str(count).ljust(11)}"
+              f"{display_statistic(mean).ljust(7)}{median.ljust(8)}"
+              f"{favourable.ljust(6)}{describe_change(previous, mean)}")
+        previous = mean
+
+
 def add_question():
     """
-    Adds a new question to the survey and spreadsheet, with a summarised
-    heading and the full text question held within the cell's note.
+    Adds one or more new questions to the survey and spreadsheet, each with a
+    summarised heading and the full text question held within the cell's
+    note.
     """
     print(colored("Adding new question to survey...\n", "yellow"))
     full_questions = get_questions("full")
@@ -617,43 +1136,76 @@ def add_question():
           "value (3).")
     print("You can update the default values by using the " +
           colored("'update'", 'light_cyan') + " function.\n")
+    new_questions = []
     while True:
-        new_question = input("Please enter the full text question you wish "
-                             "to add.\n"
-                             "Rules for question entry:\n"
-                             "-Text only, up to 70 characters\n"
-                             "-No need to add question number (done "
-                             "automatically)\n"
-                             "-The question should be formatted such that it "
-                             "can be answered\nwith a value between 1 to 5 "
-                             "(1 = Very Poor, 5 = Excellent):\n")
-        if len(new_question) <= 70:
+        while True:
+            new_question = input("Please enter the full text question you "
+                                 "wish to add.\n"
+                                 "Rules for question entry:\n"
+                                 "-Text only, up to 70 characters\n"
+                                 "-No need to add question number (done "
+                                 "automatically)\n"
+                                 "-The question should be formatted such that "
+                                 "it can be answered\nwith a value between 1 "
+                                 "to 5 (1 = Very Poor, 5 = Excellent):\n")
+            if len(new_question) <= 70:
+                break
+            else:
+                print(colored("Question too long. Please enter a question "
+                              "with a length under 70 characters."))
+        main_menu_check(new_question)
+        new_summarised_question = input("Please enter the a summarised "
+                                        "version (1 to 2 words):\n")
+        main_menu_check(new_summarised_question)
+        new_questions.append((new_question, new_summarised_question))
+        another = input("Would you like to add another question? (Y/N):\n")
+        main_menu_check(another)
+        if another not in ["Y", "y"]:
             break
-        else:
-            print(colored("Question too long. Please enter a question with a "
-                          "length under 70 characters."))
-    main_menu_check(new_question)
-    new_summarised_question = input("Please enter the a summarised version "
-                                    "(1 to 2 words):\n")
-    main_menu_check(new_summarised_question)
-    SURVEY.add_cols(1)  # adds a new empty column to the right of the sheet
-    next_question_column = SURVEY.col_count
-    # inserts the full question into the column's top cell note
-    SURVEY.insert_note(1, next_question_column, 1, next_question_column,
-                       f"Q{next_question_column - 1} - {new_question}")
-    # inserts the summarised question into the column's top cell value
-    SURVEY.update_cell(1, next_question_column, f"Q{next_question_column - 1}"
-                       f" - {new_summarised_question}")
+    write_new_questions(new_questions)
+    if len(new_questions) == 1:
+        print(colored("The question has successfully been added to the "
+                      "survey.\n", "yellow"))
+    else:
+        print(colored(f"{len(new_questions)} questions have successfully been "
+                      f"added to the survey.\n", "yellow"))
+
+
+def write_new_questions(new_questions):
+    """
+    Takes a list of (full question, summarised question) pairs and adds them
+    as new columns to the right of the sheet. The columns, their headings
+    and notes and the default value of 3 for every existing respondent are
+    added in one batch request, so they are added atomically and the number
+    of API calls does not depend on the number of respondents.
+    """
+    first_column = SURVEY.col_count + 1
+    last_column = first_column + len(new_questions) - 1
+    number_of_rows = len(SNAPSHOT.respondent_names()) + 1
     print(colored("Adding question heading...\n", "yellow"))
-    number_of_rows = len(SURVEY.col_values(1))
-    cell_index = 2
-    print(colored("Adding default value to past respondents...\n", "yellow"))
-    # updates all the empty rows below with default value of 3
-    while cell_index <= number_of_rows:
-        SURVEY.update_cell(cell_index, next_question_column, 3)
-        cell_index += 1
-    print(colored("The question has successfully been added to the survey.\n",
-                  "yellow"))
+    heading_cells = []
+    for column, (new_question, new_summarised_question) in enumerate(
+            new_questions, start=first_column):
+        # the summarised question is the cell value, the full question its
+        # note
+        heading_cells.append(storage.cell_data(
+            f"Q{column - 1} - {new_summarised_question}",
+            f"Q{column - 1} - {new_question}"))
+    requests = [storage.append_columns_request(SURVEY, len(new_questions)),
+                storage.update_cells_request(SURVEY, 1, first_column,
+                                             [heading_cells],
+                                             "userEnteredValue,note")]
+    if number_of_rows > 1:
+        print(colored("Adding default value to past respondents...\n",
+                      "yellow"))
+        # fills all the empty rows below with default value of 3
+        requests.append(storage.repeat_cell_request(
+            SURVEY, 2, first_column, number_of_rows, last_column,
+            storage.cell_data(3), "userEnteredValue"))
+    storage.batch_requests(SURVEY, requests)
+    new_headings = [heading_cell["userEnteredValue"]["stringValue"]
+                    for heading_cell in heading_cells]
+    SNAPSHOT.questions_added(new_headings, 3, number_of_rows - 1)
 
 
 def delete_respondent(name):
@@ -661,11 +1213,12 @@ def delete_respondent(name):
     Takes the validated name input by the user and deletes the corresponding
     row in the spreadsheet.
     """
-    name_cell = SURVEY.find(name)
+    row_to_delete = SNAPSHOT.respondent_row(name)
+    current_responses = read_respondent_data(name)[1:]
     while True:
         try:
             confirm = input(f"{name}'s responses are currently:\n"
-                            f"{read_respondent_data(name)[1:]}\n"
+                            f"{current_responses}\n"
                             "Are you sure you wish to delete this data? "
                             "(Y/N):\n")
             main_menu_check(confirm)
@@ -674,7 +1227,7 @@ def delete_respondent(name):
             elif confirm in ["N", "n"]:
                 print(colored("Delete aborted. Returning to main menu.\n",
                               "yellow"))
-                main()
+                raise ReturnHome()
             else:
                 print(colored("Please respond with 'Y' to proceed or 'N' to "
                               "cancel."))
@@ -682,7 +1235,8 @@ def delete_respondent(name):
             print(colored("Please respond with 'Y' to proceed or 'N' to "
                           "cancel.", "yellow"))
     print(colored(f"Deleting {name}'s data...\n", "yellow"))
-    SURVEY.delete_rows(name_cell.row)
+    SURVEY.delete_rows(row_to_delete)
+    SNAPSHOT.respondent_deleted(name, current_responses)
     print(colored(f"Deletion complete. {name}'s entry has been removed from "
                   f"the survey.\n", "yellow"))
 
@@ -691,7 +1245,8 @@ def delete_question():
     """
     Provides a list of existing question then prompts user to give the number
     of the question they wish to delete from the survey. The column is then
-    deleted and the number of the deleted question is returned to the main
+    deleted, and the questions to its right renumbered, in a single batch
+    request. The number of the deleted question is returned to the main
     function.
     """
     # list all current Qs
@@ -708,7 +1263,14 @@ def delete_question():
             if int(question_number) in range(1, SURVEY.col_count):
                 print(colored(f"Deleting question {question_number} from "
                               f"survey...\n", "yellow"))
-                SURVEY.delete_columns(int(question_number) + 1)
+                requests = [storage.delete_columns_request(
+                    SURVEY, int(question_number) + 1)]
+                # Skips if the last question was deleted, no need to update
+                if int(question_number) < len(full_questions):
+                    requests.append(update_question_cells(
+                        int(question_number), full_questions))
+                storage.batch_requests(SURVEY, requests)
+                SNAPSHOT.question_deleted(int(question_number))
                 print(colored("Deletion complete.\n", "yellow"))
                 return int(question_number)
             else:
@@ -720,22 +1282,23 @@ def delete_question():
                           f"between 1 and {SURVEY.col_count - 1}.", "yellow"))
 
 
-def update_question_cells(number_of_deleted_question):
+def update_question_cells(number_of_deleted_question, full_questions):
     """
-    Following the deletion of a question, if the question was not the last one
-    in the survey, this function updates the numbers in the summarised and full
-    versions of questions to the right of the deleted question to keep in
-    numerical ascending order.
+    When a question is deleted, if the question was not the last one in the
+    survey, the numbers in the summarised and full versions of questions to
+    the right of the deleted question must be updated to keep in numerical
+    ascending order. The new headings and notes are computed locally and
+    returned as a single request, to be sent in the same batch as the column
+    deletion (so it applies to the columns after they have shifted left).
     """
     print(colored("Updating question headings...\n", "yellow"))
-    full_questions = get_questions("full")
-    position_index = number_of_deleted_question
-    column_to_update = number_of_deleted_question + 1
-    question_index = 0
-    while position_index < SURVEY.col_count:
+    summarised_questions = get_questions("summarised")
+    heading_cells = []
+    for position_index in range(number_of_deleted_question,
+                                len(summarised_questions)):
         # Rebuilds the question and heading strings based on deleted Q
-        old_summary_string = SURVEY.cell(1, position_index + 1).value
-        old_question_string = full_questions[position_index - 1]
+        old_summary_string = summarised_questions[position_index]
+        old_question_string = full_questions[position_index]
         split_summary_string = old_summary_string.split(" ")
         split_question_string = old_question_string.split(" ")
         new_question_number = int(split_summary_string[0][1:]) - 1
@@ -743,28 +1306,28 @@ def update_question_cells(number_of_deleted_question):
         split_question_string[0] = f"Q{new_question_number}"
         new_summarised_question = ' '.join(split_summary_string)
         new_full_question = ' '.join(split_question_string)
-        SURVEY.update_cell(1, position_index + 1, new_summarised_question)
-        SURVEY.insert_note(1, column_to_update, 1, column_to_update,
-                           new_full_question)
-        position_index += 1
-        question_index += 1
-        column_to_update += 1
-    print(colored("Updating complete.\n", "yellow"))
+        heading_cells.append(storage.cell_data(new_summarised_question,
+                                               new_full_question))
+    # After the deletion the first question to renumber sits in the deleted
+    # question's column
+    return storage.update_cells_request(SURVEY, 1,
+                                        number_of_deleted_question + 1,
+                                        [heading_cells],
+                                        "userEnteredValue,note")
 
 
 def get_questions(question_type):
     """
-    Returns a list of the survey questions. The get_notes function returns
-    a list of lists containing cell notes which needs to be unpacked before
-    returning.
+    Returns a list of the survey questions. The notes (as returned by the
+    get_notes function, via the snapshot) are a list of lists containing
+    cell notes which needs to be unpacked before returning.
     """
     if question_type == "full":
-        full_questions = SURVEY.get_notes()
+        full_questions = SNAPSHOT.notes()
         return full_questions[0][1:]
     elif question_type == "summarised":
-        survey_data = SURVEY.get_all_values()
-        # Extracts the first row of data (i.e. name and all questions)
-        headings = survey_data.pop(0)
+        # Gets the first row of data (i.e. name and all questions)
+        headings = SNAPSHOT.headings()
         # Removes the name from list, leaving only the summarised questions
         headings.pop(0)
         summarised_questions = headings
@@ -783,28 +1346,29 @@ def get_border():
 def read_all_data():
     """
     Outputs full survey data including a list of all questions and a list of
-    respondents and all values.
+    respondents and all values. The respondent rows are printed as they are
+    streamed from the sheet, so output starts before a large survey has been
+    fully downloaded.
     """
     print(colored("Reading all survey data...\n", "yellow"))
-    survey_data = SURVEY.get_all_values()
     full_questions = get_questions('full')
     print(get_border())
     print(colored("QUESTION LIST:", "green"))
     for question in full_questions:
         print(question)
     print(get_border())
-    names = []
-    for row in survey_data:
-        names.append(row[0])
-    names.pop(0)
+    names = SNAPSHOT.respondent_names()
+    if not names:
+        print("There are no responses to the survey yet.")
+        print(get_border())
+        print(colored("Data output complete. Returning to main menu...\n",
+                      "yellow"))
+        return
     longest_name = len(max(names, key=len))
     print(colored("NAME", "green").ljust(longest_name+19) +
           colored(f"RESPONSES TO Q1 - {len(full_questions)}", "green"))
-    name_counter = 0
-    survey_data.pop(0)
-    for row in survey_data:
-        print(f"{names[name_counter].ljust(longest_name+10)}{row[1:]} ")
-        name_counter += 1
+    for row in SNAPSHOT.iter_respondent_rows():
+        print(f"{row[0].ljust(longest_name+10)}{row[1:]} ")
     print(get_border())
     print(colored("Data output complete. Returning to main menu...\n", "yellow"
                   ))
@@ -816,9 +1380,8 @@ def analyse_survey():
     response values for each question.
     """
     print(colored("Analysing survey data...\n", "yellow"))
-    survey_data = SURVEY.get_all_values()
     print(get_border())
-    question_averages = get_averages(survey_data, True)
+    question_averages = get_averages(SNAPSHOT.aggregates(), True)
     summarised_questions = get_questions("summarised")
     print(get_border())
     print(colored('AVERAGE SCORES\n', 'green', attrs=['bold']))
@@ -827,44 +1390,173 @@ def analyse_survey():
     longest_q = len(max(summarised_questions, key=len))
     for average_score in question_averages:
         print(f"{summarised_questions[q_index].ljust(longest_q + 5)} "
-              f"{average_score}")
+              f"{display_statistic(average_score)}")
         q_index += 1
     print(get_border())
+    print_score_distributions(SNAPSHOT.aggregates(), summarised_questions)
+    print(get_border())
     return question_averages
 
 
-def get_averages(survey_data, full_analysis):
+def get_averages(survey_aggregates, full_analysis):
     """
-    Extracts values (excludes questions & names) from survey data. Calculates
-    and returns an overall average score for each question. Outputs
+    Takes the survey's running per-question aggregates (see analytics.py),
+    which exclude the questions & names. Calculates and returns an overall
+    average score for each question, rounded to 1 decimal place. Outputs
     organisation average score if full analysis is being conducted.
     """
-    response_values = []
-    for data_row in survey_data:
-        data_row.pop(0)
-        for value in data_row:
-            if len(value) == 1:
-                response_values.append(int(value))
-            else:
-                continue
-    overall_average = statistics.mean(response_values)
+    overall_average = survey_aggregates.overall_mean()
     if full_analysis is True:
         print(colored('OVERALL SCORE', 'green', attrs=['bold']))
         print(f"Overall average score across organisation: "
               f"{round(overall_average, 1)}")
-    question_totals = []
-    number_of_responses = len(survey_data) - 1
-    for index in range(SURVEY.col_count - 1):
-        question_totals.append(0)
-    survey_data.pop(0)
-    for dataset in survey_data:
-        for index in range(len(dataset)):
-            question_totals[index] += int(dataset[index])
-    question_averages = [x/number_of_responses for x in question_totals]
+        report_invalid_cells(survey_aggregates)
+    question_averages = survey_aggregates.question_means()
     question_averages_rounded = ['%.1f' % x for x in question_averages]
     return question_averages_rounded
 
 
+def mean_of_averages(question_averages):
+    """
+    Returns the mean of the question averages returned by get_averages(),
+    rounded to 1 decimal place, leaving out the questions with no valid
+    responses.
+    """
+    defined_averages = [float(average) for average in question_averages
+                        if not math.isnan(float(average))]
+    if not defined_averages:
+        return math.nan
+    return round(statistics.mean(defined_averages), 1)
+
+
+def has_responses():
+    """
+    Returns True if the survey holds any valid responses. Otherwise, as
+    straight after a round has been closed and its responses cleared, tells
+    the user there are none to report on yet and returns False. Decided
+    from the score matrix, which the command reads anyway.
+    """
+    if SNAPSHOT.scores().valid.any():
+        return True
+    print(colored("There are no responses to the survey yet. Returning to "
+                  "main menu...\n", "yellow"))
+    return False
+
+
+def report_invalid_cells(survey_aggregates):
+    """
+    Warns that blank or invalid responses were left out of the averages,
+    listing the first few by sheet position where they are known.
+    """
+    if survey_aggregates.invalid_count == 0:
+        return
+    print(colored(f"Warning: {survey_aggregates.invalid_count} blank or "
+                  f"invalid response(s) were left out of the averages.",
+                  "yellow"))
+    for row, col, value in survey_aggregates.bad_cells:
+        cell = rowcol_to_a1(row, col)
+        print(colored(f"- {cell}: {value!r}", "yellow"))
+
+
+def display_statistic(value, decimals=1):
+    """
+    Rounds a statistic for display, showing "-" where it is undefined (e.g.
+    the spread of a question with fewer than two valid responses).
+    """
+    value = float(value)
+    if math.isnan(value):
+        return "-"
+    return f"{value:.{decimals}f}"
+
+
+def print_score_distributions(survey_aggregates, summarised_questions):
+    """
+    Outputs the median, mode, standard deviation, middle 50% (25th to 75th
+    percentile) and percentage of favourable scores for each question, all
+    taken from the running score histograms (see analytics.py).
+    """
+    medians = survey_aggregates.question_medians()
+    modes = survey_aggregates.question_modes()
+    deviations = survey_aggregates.question_standard_deviations()
+    lower_quartiles = survey_aggregates.question_percentiles(25)
+    upper_quartiles = survey_aggregates.question_percentiles(75)
+    favourable = survey_aggregates.question_favourable()
+    longest_q = len(max(summarised_questions, key=len))
+    print(colored('SCORE DISTRIBUTIONS\n', 'green', attrs=['bold']))
+    print(colored("QUESTION".ljust(longest_q + 5) + "MEDIAN".ljust(8)
+                  + "MODE".ljust(6) + "SD".ljust(6) + "MID 50%".ljust(9)
+                  + "FAVOURABLE", 'green'))
+    for index, question in enumerate(summarised_questions):
+        if modes[index] == 0:
+            print(f"{question.ljust(longest_q + 5)}No valid responses")
+            continue
+        middle = f"{lower_quartiles[index]}-{upper_quartiles[index]}"
+        print(f"{question.ljust(longest_q + 5)}"
+              f"{display_statistic(medians[index]).ljust(8)}"
+              f"{str(modes[index]).ljust(6)}"
+              f"{display_statistic(deviations[index]).ljust(6)}"
+              f"{middle.ljust(9)}"
+              f"{display_statistic(favourable[index], 0)}%")
+
+
+def print_question_distribution(survey_aggregates, question_index):
+    """
+    Outputs a bar chart of the number of respondents giving each score to a
+    question, followed by its median, mode, spread and percentage of
+    favourable scores.
+    """
+    histogram = survey_aggregates.histograms[question_index]
+    count = int(survey_aggregates.counts[question_index])
+    print(colored("SCORE DISTRIBUTION\n", 'green', attrs=['bold']))
+    if count == 0:
+        print("There are no valid responses to this question.")
+        return
+    longest_bar = 40
+    largest = int(histogram[analytics.INVALID + 1:].max())
+    for score in range(1, len(analytics.SCORE_CODES) + 1):
+        responses = int(histogram[score])
+        bar = "#" * round(responses / largest * longest_bar)
+        print(f"{score}  {bar.ljust(longest_bar)} {responses} "
+              f"({round(responses / count * 100)}%)")
+    median = survey_aggregates.question_medians()[question_index]
+    mode = survey_aggregates.question_modes()[question_index]
+    deviation = survey_aggregates.question_standard_deviations()[
+        question_index]
+    lower_quartile = survey_aggregates.question_percentiles(25)[
+        question_index]
+    upper_quartile = survey_aggregates.question_percentiles(75)[
+        question_index]
+    favourable = survey_aggregates.question_favourable()[question_index]
+    print("")
+    print(f"Median score: {display_statistic(median)}    "
+          f"Most common score: {mode}")
+    print(f"Standard deviation: {display_statistic(deviation)}    "
+          f"Middle 50% of scores: {lower_quartile} to {upper_quartile}")
+    print(f"{display_statistic(favourable, 0)}% of respondents gave a "
+          f"favourable score (4 or 5).")
+    if count < survey_aggregates.respondent_count:
+        print(f"{survey_aggregates.respondent_count - count} blank or invalid "
+              f"response(s) are not included.")
+
+
+def print_percentile_ranks(survey_aggregates, summarised_questions, codes):
+    """
+    Outputs a respondent's percentile rank on each question, given their
+    score codes: the percentage of the organisation's scores for the
+    question which are lower than theirs, counting half of those equal.
+    """
+    ranks = survey_aggregates.percentile_ranks(codes)
+    print(colored("QUESTION".ljust(32) + "SCORE".ljust(8) + "PERCENTILE RANK",
+                  'green', attrs=['bold']))
+    for question_index, rank in enumerate(ranks):
+        score = codes[question_index]
+        if score == analytics.INVALID:
+            print(f"{summarised_questions[question_index].ljust(32)}  -")
+            continue
+        print(f"{summarised_questions[question_index].ljust(32)}  {score}"
+              f"     {display_statistic(rank, 0)}")
+
+
 def get_data_insights(analysed_data):
     """
     Extracts and displays low and high scoring questions based on average
@@ -902,6 +1594,31 @@ def get_data_insights(analysed_data):
 
 
 def main():
+    """
+    Runs the application. Each pass of the loop is one visit to the main
+    menu: returning "home" (or aborting a command) raises ReturnHome, which
+    ends the current session and starts the next pass, so the call stack
+    stays the same depth however long the application runs. A request to
+    the sheet which still fails after being retried also returns to the
+    main menu, rather than ending the application.
+    """
+    while True:
+        try:
+            run_session()
+        except ReturnHome:
+            # the abandoned command is not timed while the menu is shown
+            tracing.TRACER.end_command()
+            continue
+        except (gspread.exceptions.APIError,
+                requests.exceptions.RequestException) as error:
+            tracing.TRACER.end_command()
+            # raised once the scheduler's retries are exhausted
+            print(colored(f"The survey could not be reached ({error}). "
+                          "Please try again later. Returning to main "
+                          "menu...\n", "yellow"))
+
+
+def run_session():
     """
     Runs all program functions. Gets the user permissions and runs a password
     check if admin. Uses a case statement to decide which functions to call.
@@ -912,6 +1629,12 @@ def main():
     while True:  # loops until user enters 'exit' command
         main_command = process_main_command(user_type)
         main_menu_check(main_command)
+        tracing.TRACER.begin_command(main_command)
+        if main_command != 'exit':
+            # 'exit' reads nothing, so a session which exits straight away
+            # never connects to the sheet
+            SNAPSHOT.refresh()
+            SNAPSHOT.prefetch(*COMMAND_READS.get(main_command, ()))
         match main_command:
             case 'add':
                 respondent_name = get_respondent_name('add', user_type)
@@ -934,31 +1657,58 @@ def main():
             case 'list':
                 list_respondents()
             case 'read':
-                respondent_name = get_respondent_name('read', user_type)
-                main_menu_check(respondent_name)
-                validated_read_name = validate_name(respondent_name)
-                respondent_data = read_respondent_data(validated_read_name)
-                analyse_respondent_data(respondent_data)
+                if has_responses():
+                    respondent_name = get_respondent_name('read', user_type)
+                    main_menu_check(respondent_name)
+                    validated_read_name = validate_name(respondent_name)
+                    respondent_data = read_respondent_data(
+                        validated_read_name)
+                    analyse_respondent_data(respondent_data)
             case 'add q':
                 add_question()
             case 'read q':
-                question_number = validate_question()
-                read_question_data(question_number)
+                if has_responses():
+                    question_number = validate_question()
+                    read_question_data(question_number)
             case 'delete q':
-                number_of_deleted_question = delete_question()
-                # Skips if the last question was deleted, no need to update
-                if number_of_deleted_question < SURVEY.col_count:
-                    update_question_cells(number_of_deleted_question)
+                delete_question()
             case 'read all':
                 read_all_data()
             case 'analyse':
-                analysed_data = analyse_survey()
-                get_data_insights(analysed_data)
+                if has_responses():
+                    analysed_data = analyse_survey()
+                    get_data_insights(analysed_data)
+            case 'import':
+                import_respondents()
+            case 'export':
+                export_survey_data()
+            case 'segment':
+                if has_responses():
+                    analyse_segments()
+            case 'correlate':
+                if has_responses():
+                    method = get_correlation_method()
+                    analyse_correlations(method)
+            case 'close round':
+                close_survey_round()
+            case 'trend':
+                report_trends()
             case 'exit':
+                tracing.TRACER.end_command()
                 print(colored("The application will now close.", "yellow"))
                 quit()
+        tracing.TRACER.end_command()
+
+
+def welcome():
+    """
+    Prints the welcome message shown when the application starts.
+    """
+    print("")
+    print(colored('Welcome to DT Survey Analytics.\n', 'green',
+                  attrs=['bold']))
 
 
-print("")
-print(colored('Welcome to DT Survey Analytics.\n', 'green', attrs=['bold']))
-main()
+if __name__ == "__main__":
+    welcome()
+    main()
@@ -0,0 +1,205 @@
+"""
+Quota-aware scheduling of Google Sheets API requests.
+
+The Sheets API limits each user to a number of read and of write requests
+per minute, and answers any request over the limit with a 429 error; it
+also fails requests now and then with a 5xx error. Every call made on a
+ScheduledWorksheet first takes a token from the Scheduler's read or write
+bucket, each refilled at the rate of its quota, so that heavy operations
+slow down to the quota rather than exceeding it. Calls which still fail
+with a 429 or 5xx error (or a dropped connection) are retried after an
+exponential backoff with full jitter, up to MAX_RETRIES times.
+
+A write which fails with a 5xx error or a dropped connection may still
+have been carried out, so only writes which set cells to given values
+(REPEATABLE_WRITE_METHODS) are retried then. Any other write, such as
+appending a row or deleting a column, would be repeated by a retry, and
+is only retried after a 429 error, which the API returns before carrying
+out the request.
+
+Requests waiting for a token are served in priority order: reads, which
+a user is waiting on, go ahead of writes.
+
+The quotas are set with the SURVEY_READ_QUOTA and SURVEY_WRITE_QUOTA
+environment variables (requests per minute).
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import gspread
+import requests
+
+READ_QUOTA = int(os.environ.get("SURVEY_READ_QUOTA", "60"))
+WRITE_QUOTA = int(os.environ.get("SURVEY_WRITE_QUOTA", "60"))
+# Most requests allowed in a burst, before waiting for the bucket to refill
+BURST = 10
+MAX_RETRIES = 5
+# First and longest backoff before a retry, in seconds
+BACKOFF_BASE = 1
+BACKOFF_CAP = 32
+# Order in which waiting requests are served (lowest first)
+PRIORITIES = {"read": 0, "write": 1}
+# Worksheet and spreadsheet methods which write to the sheet; any other
+# method is scheduled as a read
+WRITE_METHODS = {
+    "add_cols", "add_rows", "append_row", "append_rows", "batch_clear",
+    "batch_update", "clear", "clear_note", "delete_columns", "delete_rows",
+    "insert_cols", "insert_note", "insert_row", "insert_rows", "resize",
+    "update", "update_acell", "update_cell", "update_cells", "update_note",
+    "update_notes", "update_title",
+    }
+# Write methods which leave the sheet the same however many times they are
+# carried out. batch_update is left out, as on a Spreadsheet it may insert
+# or delete rows and columns.
+REPEATABLE_WRITE_METHODS = {
+    "batch_clear", "clear", "clear_note", "insert_note", "resize", "update",
+    "update_acell", "update_cell", "update_cells", "update_note",
+    "update_notes", "update_title",
+    }
+# HTTP status codes after which a request is retried
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# HTTP status code of a request rejected for exceeding the quota
+QUOTA_STATUS_CODE = 429
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, refilled at rate tokens per second.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def take(self):
+        """
+        Takes a token if there is one, returning 0, or else returns the
+        number of seconds until the next token is due.
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+def is_retryable(error, repeatable=True):
+    """
+    Returns True if a failed request is worth retrying: the quota was
+    exceeded, or, for a request which is safe to repeat, the server failed
+    or the connection was lost.
+    """
+    if isinstance(error, gspread.exceptions.APIError):
+        if not repeatable:
+            return error.response.status_code == QUOTA_STATUS_CODE
+        return error.response.status_code in RETRY_STATUS_CODES
+    return repeatable and isinstance(
+        error, (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout))
+
+
+def backoff_delay(attempt):
+    """
+    Returns the delay before retry number attempt (from 0): a random time
+    up to BACKOFF_BASE * 2 ** attempt seconds, capped at BACKOFF_CAP.
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class Scheduler:
+    """
+    Rate-limits and retries requests against per-minute read and write
+    quotas. Safe to use from several threads at once.
+    """
+
+    def __init__(self, read_quota=READ_QUOTA, write_quota=WRITE_QUOTA,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.buckets = {
+            "read": TokenBucket(read_quota / 60, min(BURST, read_quota),
+                                clock),
+            "write": TokenBucket(write_quota / 60, min(BURST, write_quota),
+                                 clock),
+            }
+        self.sleep = sleep
+        self.retries = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, kind):
+        """
+        Waits until it is this request's turn and a token is available in
+        the bucket for its kind ("read" or "write"), then takes the token.
+        """
+        entry = (PRIORITIES[kind], next(self._order))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            self._condition.notify_all()
+            while True:
+                if self._waiting[0] == entry:
+                    delay = self.buckets[kind].take()
+                    if delay == 0:
+                        heapq.heappop(self._waiting)
+                        self._condition.notify_all()
+                        return
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+
+    def call(self, kind, function, *args, repeatable=True, **kwargs):
+        """
+        Calls the function once a token is available, retrying it with
+        backoff if it fails with a retryable error. A call which is not
+        repeatable is only retried if it was rejected for exceeding the
+        quota.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire(kind)
+            try:
+                return function(*args, **kwargs)
+            except (gspread.exceptions.APIError,
+                    requests.exceptions.RequestException) as error:
+                if attempt == MAX_RETRIES \
+                        or not is_retryable(error, repeatable):
+                    raise
+                self.retries += 1
+                self.sleep(backoff_delay(attempt))
+
+
+class ScheduledWorksheet:
+    """
+    Wraps a gspread Worksheet (or its Spreadsheet) so that every method
+    call goes through the scheduler. Other attributes are passed through.
+    """
+
+    def __init__(self, target, scheduler):
+        self._target = target
+        self._scheduler = scheduler
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name == "spreadsheet":
+            return ScheduledWorksheet(value, self._scheduler)
+        if not callable(value):
+            return value
+        kind = "write" if name in WRITE_METHODS else "read"
+        repeatable = kind == "read" or name in REPEATABLE_WRITE_METHODS
+
+        def scheduled(*args, **kwargs):
+            return self._scheduler.call(kind, value, *args,
+                                        repeatable=repeatable, **kwargs)
+        return scheduled
+
+
+# Shared by every scheduled worksheet, so the quotas apply to them all
+SCHEDULER = Scheduler()
@@ -0,0 +1,147 @@
+"""
+Long-running survey service behind the web terminal.
+
+Rather than starting a new 'python3 run.py' for every terminal, the web
+server (controllers/default.js) starts this service once and connects each
+terminal to it over a Unix socket. The service holds a single copy of the
+application state - the authorised sheet connection, the snapshot of the
+survey and its indexes (the SURVEY and SNAPSHOT globals of run.py) - and
+runs each terminal as a session on its own thread, so every visitor after
+the first skips the interpreter start-up, imports, OAuth and opening of the
+sheet, and shares the cached survey data.
+
+Each session runs the usual menus (run.main()) with its own input and
+output: sys.stdin and sys.stdout are replaced by proxies which pass reads
+and writes to the stream of the current thread's session. Only one session
+runs at a time - a session holds SERVICE_LOCK except while it is waiting
+for its user to type - so the shared state is never changed by two
+commands at once. Each command refreshes the shared snapshot, under
+SERVICE_LOCK, when it starts, and a session's writes update or invalidate
+it for every session, so no session answers from rows which another has
+since changed. The tracer keeps each session's current command apart (see
+tracing.py), so calls are counted against the command which made them.
+
+The socket path is set with SURVEY_SERVICE_SOCKET.
+"""
+import os
+import socket
+import sys
+import threading
+
+# The web terminal shows colours, although the output is not a terminal.
+# Must be set before the first coloured message, as termcolor caches it.
+os.environ.setdefault("FORCE_COLOR", "1")
+
+import run  # noqa: E402
+
+SOCKET_PATH = os.environ.get("SURVEY_SERVICE_SOCKET", "survey_service.sock")
+# Held by the session which is running, released while it waits for input
+SERVICE_LOCK = threading.Lock()
+SESSION = threading.local()
+
+
+class SessionInput:
+    """
+    Reads a session's lines from its connection. SERVICE_LOCK is released
+    while waiting, so that other sessions can run.
+    """
+
+    def __init__(self, connection):
+        self._reader = connection.makefile("r", encoding="utf-8",
+                                           newline="\n")
+
+    def readline(self):
+        SERVICE_LOCK.release()
+        try:
+            line = self._reader.readline()
+        finally:
+            SERVICE_LOCK.acquire()
+        return line.replace("\r", "")
+
+    def close(self):
+        self._reader.close()
+
+
+class SessionOutput:
+    """
+    Writes a session's output to its connection, with the line endings a
+    terminal expects.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def write(self, text):
+        self._connection.sendall(text.replace("\n", "\r\n").encode("utf-8"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return True
+
+
+class ThreadLocalStream:
+    """
+    Stands in for sys.stdin or sys.stdout, passing every call to the stream
+    of the current thread's session, or to the process's own stream for
+    threads which are not running a session.
+    """
+
+    def __init__(self, name, default):
+        self._name = name
+        self._default = default
+
+    def __getattr__(self, attribute):
+        stream = getattr(SESSION, self._name, None) or self._default
+        return getattr(stream, attribute)
+
+
+def serve_session(connection):
+    """
+    Runs the application for one terminal connection until the user exits
+    or disconnects.
+    """
+    SERVICE_LOCK.acquire()
+    SESSION.stdin = SessionInput(connection)
+    SESSION.stdout = SessionOutput(connection)
+    try:
+        run.welcome()
+        run.main()
+    except (SystemExit, EOFError, OSError):
+        # 'exit', a closed terminal or a dropped connection
+        pass
+    finally:
+        SESSION.stdin = None
+        SESSION.stdout = None
+        SERVICE_LOCK.release()
+        connection.close()
+
+
+def serve(path=SOCKET_PATH):
+    """
+    Listens on the Unix socket at the path, starting a session for each
+    connection.
+    """
+    try:
+        run.SURVEY.resolve()
+    except Exception as error:
+        # the sheet will be opened when first used instead
+        print(f"Could not open the survey yet: {error}", file=sys.stderr)
+    if os.path.exists(path):
+        os.remove(path)
+    sys.stdin = ThreadLocalStream("stdin", sys.stdin)
+    sys.stdout = ThreadLocalStream("stdout", sys.stdout)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+        print(f"Survey service listening on {path}", file=sys.stderr)
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(target=serve_session, args=(connection,),
+                             daemon=True).start()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,468 @@
+"""
+Per-command snapshot of the survey grid.
+
+Most commands need several views of the same data (the headings, a column
+of names, a respondent's row, the whole grid for averages). Rather than
+downloading the grid for each of them, SurveySnapshot fetches it once and
+serves every read from that copy until it is invalidated, either
+explicitly after a write or because the sheet's version has changed.
+
+The snapshot also keeps some longer-lived state about the survey: a hash
+index from respondent name to sheet row, the question headings, and the
+running per-question aggregates (see analytics.RunningAggregates). Unlike
+the grid, this state survives the application's own writes - it is updated
+in place by the respondent_added(), respondents_added(),
+respondent_deleted(), respondents_cleared(), responses_updated(),
+questions_added() and question_deleted() hooks - and is only rebuilt when
+someone else has changed the sheet.
+
+The cell notes (the admin password and the full text of each question) are
+kept in the same way: they only change when the survey's structure does,
+so they survive the application's writes of responses and are dropped by
+the questions_added() and question_deleted() hooks or when someone else has
+changed the sheet. For the live sheet they are also saved to a cache file
+(storage.NOTES_CACHE_FILE) tagged with the sheet's version, so a new
+session whose sheet is unchanged reads them from disk rather than with the
+heavy get_notes() request. The admin password is left out of the file, and
+such a session reads it on its own from the note of A1 when first needed.
+"""
+import contextvars
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+
+import gspread
+
+import analytics
+import storage
+
+# Number of incremental updates after which the running aggregates are
+# rebuilt from the sheet, catching any drift between the two
+RECONCILE_INTERVAL = 25
+
+
+class SurveySnapshot:
+    """
+    Read-through cache of the survey values. Offers the read methods of a
+    gspread Worksheet that the application uses, all served from a single
+    get_all_values() call, along with the cell notes.
+    """
+
+    def __init__(self, worksheet, notes_cache_file=None):
+        self.worksheet = worksheet
+        self.notes_cache_file = notes_cache_file
+        self._values = None
+        self._scores = None
+        self._notes = None
+        self._notes_version = None
+        self._admin_password = None
+        self._attributes = None
+        self._correlations = {}
+        self._version = None
+        self._seen_version = None
+        self._names = None
+        self._name_rows = None
+        self._headings = None
+        self._aggregates = None
+        self._updates_since_reconcile = 0
+        self._state_version = None
+
+    def refresh(self):
+        """
+        Called at the start of each command. Keeps the cached grid and the
+        survey state only if the sheet's version is known and unchanged
+        since they were last brought up to date.
+        """
+        version = storage.get_version(self.worksheet)
+        if version is None or version != self._version:
+            self._values = None
+            self._scores = None
+            self._attributes = None
+            self._correlations = {}
+        if version is None or version != self._notes_version:
+            self._notes = None
+            self._notes_version = None
+        if version is None or version != self._state_version:
+            self._names = None
+            self._name_rows = None
+            self._headings = None
+            self._aggregates = None
+            self._state_version = None
+        self._version = version
+        self._seen_version = version
+
+    def invalidate(self):
+        """
+        Drops the cached grid. Must be called after writing to the sheet.
+        The survey state and notes are kept and marked as matching the
+        sheet's new version, so writes which change them must call the
+        matching hook (e.g. respondent_added()) instead.
+        """
+        self._values = None
+        self._scores = None
+        self._attributes = None
+        self._correlations = {}
+        self._version = None
+        if self._state_loaded() or self._notes is not None:
+            version = storage.get_version(self.worksheet)
+            if self._state_loaded():
+                self._state_version = version
+            if self._notes is not None:
+                self._notes_version = version
+                storage.save_notes_cache(self.notes_cache_file, version,
+                                         self._notes)
+
+    def _state_loaded(self):
+        return self._names is not None or self._headings is not None \
+            or self._aggregates is not None
+
+    def _state_built(self):
+        """
+        Tags newly built survey state with the version it was read at, if
+        no other state is held yet.
+        """
+        if self._state_version is None:
+            self._state_version = self._seen_version
+
+    def rows(self):
+        """
+        Returns the cached grid, fetching it if required. The rows are shared
+        with the cache so must not be modified by the caller.
+        """
+        if self._values is None:
+            self._values = self.worksheet.get_all_values()
+        return self._values
+
+    def notes(self):
+        """
+        Returns the cell notes (get_notes()), which hold the password and the
+        full text of each question. Taken from the cache file if it was saved
+        at the sheet's current version, otherwise fetched and saved to it.
+        Notes taken from the file leave the password blank (see
+        admin_password()).
+        """
+        if self._notes is None:
+            version = self._seen_version
+            notes = storage.load_notes_cache(self.notes_cache_file, version)
+            self._admin_password = None
+            if notes is None:
+                notes = self.worksheet.get_notes()
+                storage.save_notes_cache(self.notes_cache_file, version,
+                                         notes)
+                self._admin_password = notes[0][0] \
+                    if notes and notes[0] else ""
+            self._notes = notes
+            self._notes_version = version
+        return self._notes
+
+    def admin_password(self):
+        """
+        Returns the admin password, held in the note of the first cell (A1).
+        It is kept in memory only, so if the notes came from the cache file
+        the note of A1 is read on its own.
+        """
+        self.notes()
+        if self._admin_password is None:
+            self._admin_password = self.worksheet.get_note("A1") or ""
+        return self._admin_password
+
+    def attributes(self):
+        """
+        Returns the respondent attributes (see storage.open_attributes()) as
+        the list of attribute names and a dict from each respondent's name
+        to their list of values, both empty if the survey has none. Cached
+        and invalidated along with the grid.
+        """
+        if self._attributes is None:
+            worksheet = storage.open_attributes(self.worksheet)
+            rows = worksheet.get_all_values() if worksheet is not None else []
+            respondent_values = {}
+            for row in rows[1:]:
+                if row and row[0].strip():
+                    respondent_values.setdefault(row[0].strip(), row[1:])
+            self._attributes = (rows[0][1:] if rows else [],
+                                respondent_values)
+        return self._attributes
+
+    def prefetch(self, *reads):
+        """
+        Loads the named reads - any of "grid", "names", "headings", "notes"
+        and "attributes" - which are not already held, issuing the requests
+        for them in parallel so that a command waits for the slowest rather
+        than for all of them in turn. Names and headings come from the grid
+        when it is one of the reads, rather than being requested separately.
+        """
+        loaders = []
+        if "grid" in reads and self._values is None:
+            loaders.append(self.rows)
+        elif "grid" not in reads:
+            if "names" in reads and self._names is None:
+                loaders.append(self._build_index)
+            if "headings" in reads and self._headings is None:
+                loaders.append(self.headings)
+        if "notes" in reads and self._notes is None:
+            loaders.append(self.notes)
+        if "attributes" in reads and self._attributes is None:
+            loaders.append(self.attributes)
+        if len(loaders) < 2:
+            for loader in loaders:
+                loader()
+            return
+        # each loader runs in a copy of this thread's context, so its
+        # requests are traced against the current command
+        with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       loader)
+                       for loader in loaders]
+        for future in futures:
+            future.result()
+
+    def iter_respondent_rows(self):
+        """
+        Yields each respondent's row (name followed by scores). Served from
+        the cached grid if there is one, otherwise streamed from the sheet a
+        page at a time without caching the whole grid.
+        """
+        if self._values is not None:
+            yield from self._values[1:]
+        else:
+            yield from storage.iter_rows(self.worksheet, first_row=2)
+
+    def scores(self):
+        """
+        Returns the survey parsed into an analytics.SurveyScores matrix,
+        parsing the cached grid at most once. If the grid is not cached the
+        rows are streamed into the matrix instead, so only the compact
+        matrix is held.
+        """
+        if self._scores is None:
+            if self._values is not None:
+                self._scores = analytics.SurveyScores(self._values)
+            else:
+                self._scores = analytics.SurveyScores.from_rows(
+                    self.headings(), self.iter_respondent_rows())
+        return self._scores
+
+    def correlations(self, method="pearson"):
+        """
+        Returns the question-by-question correlation matrix of the scores
+        for the method (see analytics.correlation_matrix()). Cached with the
+        grid, so it is kept between commands until the sheet changes and
+        the scores need not be read again to answer it.
+        """
+        if method not in self._correlations:
+            self._correlations[method] = analytics.correlation_matrix(
+                self.scores().matrix, method)
+        return self._correlations[method]
+
+    @property
+    def col_count(self):
+        return self.worksheet.col_count
+
+    def get_all_values(self):
+        return [list(row) for row in self.rows()]
+
+    def col_values(self, col):
+        column = [row[col - 1] if col <= len(row) else ""
+                  for row in self.rows()]
+        while column and column[-1] == "":
+            column.pop()
+        return column
+
+    def row_values(self, row):
+        rows = self.rows()
+        values = list(rows[row - 1]) if row <= len(rows) else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def cell(self, row, col):
+        rows = self.rows()
+        value = ""
+        if row <= len(rows) and col <= len(rows[row - 1]):
+            value = rows[row - 1][col - 1]
+        return gspread.Cell(row, col, value)
+
+    def find(self, query):
+        for row_index, row in enumerate(self.rows(), start=1):
+            for col_index, value in enumerate(row, start=1):
+                if value == query:
+                    return gspread.Cell(row_index, col_index, value)
+        return None
+
+    def headings(self):
+        """
+        Returns the first row of the sheet ("Name" and the summarised
+        questions), from the cached grid or a single row read.
+        """
+        if self._headings is None:
+            if self._values is not None:
+                self._headings = self.row_values(1)
+            else:
+                self._headings = self.worksheet.row_values(1)
+            self._state_built()
+        return list(self._headings)
+
+    def aggregates(self):
+        """
+        Returns the running per-question aggregates, building them when first
+        needed from the score matrix if it or the grid is cached, or else
+        from the respondent rows streamed in pages. Every RECONCILE_INTERVAL
+        updates they are rebuilt from the sheet and compared, reporting any
+        drift to stderr.
+        """
+        if self._aggregates is None \
+                or self._updates_since_reconcile >= RECONCILE_INTERVAL:
+            if self._values is not None or self._scores is not None:
+                rebuilt = analytics.RunningAggregates.from_scores(
+                    self.scores())
+            else:
+                rebuilt = analytics.RunningAggregates.from_rows(
+                    self.iter_respondent_rows(), len(self.headings()) - 1)
+            if self._aggregates is not None \
+                    and not self._aggregates.matches(rebuilt):
+                print("The running aggregates had drifted from the sheet "
+                      "and have been rebuilt.", file=sys.stderr)
+            self._aggregates = rebuilt
+            self._updates_since_reconcile = 0
+            self._state_built()
+        return self._aggregates
+
+    def _build_index(self):
+        """
+        Builds the name index from the first column - taken from the cached
+        grid if there is one, otherwise read on its own. The header ("Name")
+        is not included. If a name appears twice, the first row is kept, as
+        find() would return.
+        """
+        if self._values is not None:
+            column = self.col_values(1)
+        else:
+            column = self.worksheet.col_values(1)
+        self._names = column[1:]
+        self._reindex()
+        self._state_built()
+
+    def _reindex(self):
+        self._name_rows = {}
+        for row, name in enumerate(self._names, start=2):
+            self._name_rows.setdefault(name, row)
+
+    def respondent_names(self):
+        """
+        Returns the list of respondent names in sheet order.
+        """
+        if self._names is None:
+            self._build_index()
+        return list(self._names)
+
+    def respondent_row(self, name):
+        """
+        Returns the sheet row holding the given respondent's responses, or
+        None if there is no such respondent.
+        """
+        if self._name_rows is None:
+            self._build_index()
+        return self._name_rows.get(name)
+
+    def respondent_added(self, name, scores):
+        """
+        Records a respondent appended to the bottom of the sheet with the
+        given scores, and invalidates the cached grid.
+        """
+        if self._names is not None:
+            self._names.append(name)
+            self._name_rows.setdefault(name, len(self._names) + 1)
+        if self._aggregates is not None:
+            self._aggregates.add_respondent(scores)
+            self._updates_since_reconcile += 1
+        self.invalidate()
+
+    def respondents_added(self, rows):
+        """
+        Records several respondents appended to the bottom of the sheet in
+        one go, each row holding a name followed by scores, and invalidates
+        the cached grid once.
+        """
+        if self._names is not None:
+            for row in rows:
+                self._names.append(row[0])
+                self._name_rows.setdefault(row[0], len(self._names) + 1)
+        if self._aggregates is not None:
+            self._aggregates.add_respondents(rows)
+            self._updates_since_reconcile += 1
+        self.invalidate()
+
+    def respondent_deleted(self, name, scores):
+        """
+        Records the deletion of a respondent's row (holding the given
+        scores), shifting the rows of the respondents below it up by one,
+        and invalidates the cached grid.
+        """
+        if self._names is not None:
+            del self._names[self._name_rows[name] - 2]
+            self._reindex()
+        if self._aggregates is not None:
+            self._aggregates.remove_respondent(scores)
+            self._updates_since_reconcile += 1
+        self.invalidate()
+
+    def respondents_cleared(self):
+        """
+        Records the deletion of every respondent's row (e.g. to start a new
+        round of the survey), keeping the questions, and invalidates the
+        cached grid.
+        """
+        if self._names is not None:
+            self._names = []
+            self._reindex()
+        if self._aggregates is not None:
+            self._aggregates = analytics.RunningAggregates.empty(
+                self._aggregates.question_count)
+            self._updates_since_reconcile = 0
+        self.invalidate()
+
+    def responses_updated(self, old_scores, new_scores):
+        """
+        Records a change to one respondent's scores, given as their list of
+        scores before and after (blank trailing scores may be left out), and
+        invalidates the cached grid.
+        """
+        if self._aggregates is not None:
+            for question_index, (old_score, new_score) in enumerate(
+                    zip_longest(old_scores, new_scores, fillvalue="")):
+                if analytics.score_code(old_score) \
+                        != analytics.score_code(new_score):
+                    self._aggregates.update_score(question_index,
+                                                  old_score, new_score)
+            self._updates_since_reconcile += 1
+        self.invalidate()
+
+    def questions_added(self, headings, default_score, respondent_count):
+        """
+        Records new question columns with the given headings, filled with
+        the default score for every existing respondent, and invalidates the
+        cached grid and the notes.
+        """
+        self._notes = None
+        if self._headings is not None:
+            self._headings.extend(headings)
+        if self._aggregates is not None:
+            self._aggregates.add_questions(len(headings), default_score,
+                                           respondent_count)
+            self._updates_since_reconcile += 1
+        self.invalidate()
+
+    def question_deleted(self, question_number):
+        """
+        Records the deletion of a question's column and invalidates the
+        cached grid and the notes. The headings of the following questions
+        are renumbered by the deletion, so they are read again when next
+        needed.
+        """
+        self._headings = None
+        self._notes = None
+        if self._aggregates is not None:
+            self._aggregates.remove_question(question_number - 1)
+            self._updates_since_reconcile += 1
+        self.invalidate()
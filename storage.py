@@ -0,0 +1,778 @@
+"""
+Storage backends for the survey worksheet.
+
+The application only ever talks to the survey through the subset of the
+gspread Worksheet API listed in the readme (get_all_values, col_values,
+find, update_cell, append_row, get_notes etc.). Any object offering those
+methods can be used as the survey, so two backends are provided:
+- 'gspread' (default) opens the live Google Sheet
+- 'local' uses LocalWorksheet, an in-process stand-in which holds the grid
+  in memory and optionally saves it to a JSON file
+
+The backend is chosen with the SURVEY_BACKEND environment variable, and the
+local file with SURVEY_LOCAL_FILE.
+
+Connecting is deferred until the survey is first used (see LazyWorksheet),
+and the OAuth access token and spreadsheet id are cached on disk so that
+later sessions can skip the token request and the Drive title search.
+"""
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+import gspread
+from gspread.utils import ValueInputOption, a1_to_rowcol, rowcol_to_a1
+from google.oauth2.service_account import Credentials
+
+import scheduler
+import tracing
+
+SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive"
+    ]
+
+SHEET_NAME = "DT_survey_analytics"
+WORKSHEET_NAME = "survey_results"
+# Optional worksheet of respondent attributes (see open_attributes)
+ATTRIBUTES_WORKSHEET_NAME = "respondent_attributes"
+BACKEND = os.environ.get("SURVEY_BACKEND", "gspread")
+LOCAL_FILE = os.environ.get("SURVEY_LOCAL_FILE", "survey_local.json")
+LOCAL_ATTRIBUTES_FILE = os.environ.get("SURVEY_LOCAL_ATTRIBUTES_FILE",
+                                       "survey_local_attributes.json")
+TOKEN_CACHE_FILE = os.environ.get("SURVEY_TOKEN_CACHE", ".token_cache.json")
+# The question notes are only cached between sessions for the live sheet,
+# as the version of a local sheet starts again from 0 in every session
+NOTES_CACHE_FILE = None if BACKEND == "local" \
+    else os.environ.get("SURVEY_NOTES_CACHE", ".notes_cache.json")
+# Number of rows fetched per request when streaming the sheet
+PAGE_SIZE = int(os.environ.get("SURVEY_PAGE_SIZE", "1000"))
+
+
+def format_value(value):
+    """
+    Converts a value written to the sheet into the string the Sheets API
+    would give back when reading it, e.g. 3 and 3.0 are both read as "3".
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class LocalWorksheet:
+    """
+    In-process stand-in for a gspread Worksheet. Cell values and notes are
+    held as lists of rows of strings, read back the same way the Sheets API
+    returns them. If a path is given, the sheet is saved to that JSON file
+    after every write so the data persists between sessions.
+    """
+
+    def __init__(self, values=None, notes=None, row_count=None,
+                 col_count=None, path=None, title=WORKSHEET_NAME):
+        self.title = title
+        self.id = 0
+        self.path = path
+        # incremented on every write, like the Drive modified time
+        self.version = 0
+        self._values = [[format_value(v) for v in row]
+                        for row in (values or [])]
+        self._notes = [list(row) for row in (notes or [])]
+        widest_row = max([len(row) for row in self._values], default=0)
+        self._row_count = max(row_count or 0, len(self._values), 1)
+        self._col_count = max(col_count or 0, widest_row, 1)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Creates a worksheet from a JSON file previously written by save().
+        """
+        with open(path, encoding="utf-8") as local_file:
+            data = json.load(local_file)
+        return cls(data["values"], data["notes"], data["row_count"],
+                   data["col_count"], path, data.get("title", WORKSHEET_NAME))
+
+    @classmethod
+    def copy_of(cls, worksheet, path=None):
+        """
+        Creates a local copy of another worksheet (e.g. the live gspread one)
+        including its notes and grid size.
+        """
+        local_copy = cls(worksheet.get_all_values(), worksheet.get_notes(),
+                         worksheet.row_count, worksheet.col_count, path,
+                         worksheet.title)
+        local_copy.save()
+        return local_copy
+
+    def _changed(self):
+        """
+        Records that the sheet has been written to and saves it.
+        """
+        self.version += 1
+        self.save()
+
+    def save(self):
+        """
+        Writes the sheet to its JSON file, if it has one.
+        """
+        if self.path is None:
+            return
+        data = {
+            "title": self.title,
+            "row_count": self._row_count,
+            "col_count": self._col_count,
+            "values": self._values,
+            "notes": self._notes,
+            }
+        with open(self.path, "w", encoding="utf-8") as local_file:
+            json.dump(data, local_file)
+
+    @property
+    def row_count(self):
+        return self._row_count
+
+    @property
+    def col_count(self):
+        return self._col_count
+
+    def _get(self, grid, row, col):
+        """
+        Returns the string held at a 1-indexed position in the given grid.
+        """
+        if row <= len(grid) and col <= len(grid[row - 1]):
+            return grid[row - 1][col - 1]
+        return ""
+
+    def _set(self, grid, row, col, value):
+        """
+        Stores a string at a 1-indexed position in the given grid, extending
+        the grid as required.
+        """
+        while len(grid) < row:
+            grid.append([])
+        grid_row = grid[row - 1]
+        while len(grid_row) < col:
+            grid_row.append("")
+        grid_row[col - 1] = value
+
+    def _trimmed(self, grid):
+        """
+        Returns a rectangular copy of the grid with trailing empty rows and
+        columns removed, matching the shape of a Sheets API values response.
+        """
+        last_row = 0
+        width = 0
+        for row_index, row in enumerate(grid, start=1):
+            filled = [index for index, value in enumerate(row, start=1)
+                      if value]
+            if filled:
+                last_row = row_index
+                width = max(width, filled[-1])
+        return [(row[:width] + [""] * (width - len(row)))[:width]
+                for row in grid[:last_row]]
+
+    def get_all_values(self):
+        return self._trimmed(self._values)
+
+    def get_values(self, range_name=None):
+        """
+        Returns the values in an A1 range such as 'A2:K1001', trimmed of
+        trailing empty rows and columns as the Sheets API does.
+        """
+        if range_name is None:
+            return self.get_all_values()
+        first_cell, last_cell = range_name.split(":")
+        first_row, first_col = a1_to_rowcol(first_cell)
+        last_row, last_col = a1_to_rowcol(last_cell)
+        block = [row[first_col - 1:last_col]
+                 for row in self._values[first_row - 1:last_row]]
+        return self._trimmed(block)
+
+    def col_values(self, col):
+        column = [self._get(self._values, row, col)
+                  for row in range(1, len(self._values) + 1)]
+        while column and column[-1] == "":
+            column.pop()
+        return column
+
+    def row_values(self, row):
+        values = list(self._values[row - 1]) if row <= len(self._values) \
+            else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def cell(self, row, col):
+        return gspread.Cell(row, col, self._get(self._values, row, col))
+
+    def find(self, query):
+        for row_index, row in enumerate(self._values, start=1):
+            for col_index, value in enumerate(row, start=1):
+                if value == query:
+                    return gspread.Cell(row_index, col_index, value)
+        return None
+
+    def get_notes(self):
+        notes = [list(row) for row in self._notes]
+        for row in notes:
+            while row and row[-1] == "":
+                row.pop()
+        while notes and not notes[-1]:
+            notes.pop()
+        return notes
+
+    def get_note(self, cell):
+        row, col = a1_to_rowcol(cell)
+        return self._get(self._notes, row, col)
+
+    def insert_note(self, *args):
+        """
+        Accepts either ('B1', content) or (first_row, first_col, last_row,
+        last_col, content) like the gspread method.
+        """
+        content = args[-1]
+        if len(args) == 2:
+            row, col = a1_to_rowcol(args[0])
+        else:
+            row, col = args[0], args[1]
+        self._set(self._notes, row, col, content)
+        self._changed()
+
+    update_note = insert_note
+
+    def update_cell(self, row, col, value):
+        self._set(self._values, row, col, format_value(value))
+        self._row_count = max(self._row_count, row)
+        self._col_count = max(self._col_count, col)
+        self._changed()
+
+    def batch_update(self, data, value_input_option=None):
+        """
+        Writes several ranges of values, given as a list of
+        {'range': 'B2:E2', 'values': [[...]]} dicts, in one go.
+        """
+        for update in data:
+            first_row, first_col = a1_to_rowcol(update["range"].split(":")[0])
+            for row_offset, row_values in enumerate(update["values"]):
+                for col_offset, value in enumerate(row_values):
+                    row = first_row + row_offset
+                    col = first_col + col_offset
+                    self._set(self._values, row, col, format_value(value))
+                    self._row_count = max(self._row_count, row)
+                    self._col_count = max(self._col_count, col)
+        self._changed()
+
+    @property
+    def spreadsheet(self):
+        return LocalSpreadsheet(self)
+
+    def apply_requests(self, requests):
+        """
+        Applies Sheets API batchUpdate requests to the local grid. Supports
+        the request types built by the helper functions below:
+        updateCells, repeatCell, deleteDimension and appendDimension.
+        """
+        for request in requests:
+            request_type, body = next(iter(request.items()))
+            if request_type == "updateCells":
+                grid = body["range"]
+                for row_offset, row_data in enumerate(body["rows"]):
+                    for col_offset, cell in enumerate(row_data["values"]):
+                        self._apply_cell(
+                            grid["startRowIndex"] + row_offset + 1,
+                            grid["startColumnIndex"] + col_offset + 1,
+                            cell, body["fields"])
+            elif request_type == "repeatCell":
+                grid = body["range"]
+                for row in range(grid["startRowIndex"] + 1,
+                                 grid["endRowIndex"] + 1):
+                    for col in range(grid["startColumnIndex"] + 1,
+                                     grid["endColumnIndex"] + 1):
+                        self._apply_cell(row, col, body["cell"],
+                                         body["fields"])
+            elif request_type == "deleteDimension":
+                dimension = body["range"]
+                delete = self.delete_rows \
+                    if dimension["dimension"] == "ROWS" \
+                    else self.delete_columns
+                delete(dimension["startIndex"] + 1, dimension["endIndex"])
+            elif request_type == "appendDimension":
+                if body["dimension"] == "ROWS":
+                    self._row_count += body["length"]
+                else:
+                    self._col_count += body["length"]
+            else:
+                raise ValueError(f"Unsupported request: {request_type}")
+        self._changed()
+
+    def _apply_cell(self, row, col, cell, fields):
+        """
+        Writes the value and/or note of a Sheets API CellData to a cell.
+        """
+        if "userEnteredValue" in fields:
+            entered_value = cell.get("userEnteredValue", {})
+            value = next(iter(entered_value.values()), "")
+            self._set(self._values, row, col, format_value(value))
+        if "note" in fields:
+            self._set(self._notes, row, col, cell.get("note", ""))
+        self._row_count = max(self._row_count, row)
+        self._col_count = max(self._col_count, col)
+
+    def append_row(self, values):
+        self.append_rows([values])
+
+    def append_rows(self, values):
+        last_row = len(self._trimmed(self._values))
+        del self._values[last_row:]
+        for row in values:
+            self._values.append([format_value(value) for value in row])
+            self._col_count = max(self._col_count, len(row))
+        self._row_count = max(self._row_count, len(self._values))
+        self._changed()
+
+    def add_cols(self, cols):
+        self._col_count += cols
+        self._changed()
+
+    def delete_rows(self, start_index, end_index=None):
+        end_index = end_index or start_index
+        del self._values[start_index - 1:end_index]
+        del self._notes[start_index - 1:end_index]
+        self._row_count -= end_index - start_index + 1
+        self._changed()
+
+    def delete_columns(self, start_index, end_index=None):
+        end_index = end_index or start_index
+        for row in self._values + self._notes:
+            del row[start_index - 1:end_index]
+        self._col_count -= end_index - start_index + 1
+        self._changed()
+
+
+def load_token_cache(client_email):
+    """
+    Returns the cached access token details for the given service account,
+    or an empty dict if there is no usable cache.
+    """
+    try:
+        with open(TOKEN_CACHE_FILE, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("client_email") != client_email:
+        return {}
+    return cache
+
+
+def save_token_cache(creds, spreadsheet_id):
+    """
+    Saves the current access token, its expiry and the spreadsheet id so the
+    next session can reuse them. The file is only readable by its owner.
+    """
+    if creds.token is None or creds.expiry is None:
+        return
+    cache = {
+        "client_email": creds.service_account_email,
+        "token": creds.token,
+        "expiry": creds.expiry.isoformat(),
+        "spreadsheet_id": spreadsheet_id,
+        }
+    try:
+        descriptor = os.open(TOKEN_CACHE_FILE,
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as cache_file:
+            json.dump(cache, cache_file)
+    except OSError:
+        pass  # caching is an optimisation only, the session can carry on
+
+
+def load_notes_cache(path, version):
+    """
+    Returns the notes cached in the file if they were saved at the given
+    sheet version, or None if there is no such cache. The note of A1 (the
+    admin password) is never cached, so is returned blank; a cache which
+    holds one, saved by an older version, is ignored.
+    """
+    if path is None or version is None:
+        return None
+    try:
+        with open(path, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    notes = cache.get("notes")
+    if cache.get("version") != version or not isinstance(notes, list) \
+            or (notes and notes[0] and notes[0][0]):
+        return None
+    return notes
+
+
+def save_notes_cache(path, version, notes):
+    """
+    Saves the notes read at the given sheet version so later sessions can
+    reuse them. The note of A1, which holds the admin password, is left
+    blank so the password is only ever held in memory.
+    """
+    if path is None or version is None:
+        return
+    notes = [list(row) for row in notes]
+    if notes and notes[0]:
+        notes[0][0] = ""
+    try:
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0o600)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as cache_file:
+            json.dump({"version": version, "notes": notes}, cache_file)
+    except (OSError, TypeError):
+        pass  # caching is an optimisation only, the session can carry on
+
+
+def connect_gspread():
+    """
+    Authorises with the service account and opens the survey worksheet.
+    A cached token is reused until it expires (google-auth refreshes it
+    automatically after that), and a cached spreadsheet id lets the sheet
+    be opened by key rather than searched for by title.
+    """
+    creds = Credentials.from_service_account_file("creds.json")
+    scoped_creds = creds.with_scopes(SCOPE)
+    cache = load_token_cache(scoped_creds.service_account_email)
+    if cache.get("token") and cache.get("expiry"):
+        scoped_creds.token = cache["token"]
+        scoped_creds.expiry = datetime.fromisoformat(cache["expiry"])
+    gspread_client = gspread.authorize(scoped_creds)
+    sheet = None
+    if cache.get("spreadsheet_id"):
+        try:
+            sheet = gspread_client.open_by_key(cache["spreadsheet_id"])
+        except gspread.SpreadsheetNotFound:
+            sheet = None
+    if sheet is None or sheet.title != SHEET_NAME:
+        sheet = gspread_client.open(SHEET_NAME)
+    worksheet = sheet.worksheet(WORKSHEET_NAME)
+    if scoped_creds.token != cache.get("token") \
+            or sheet.id != cache.get("spreadsheet_id"):
+        save_token_cache(scoped_creds, sheet.id)
+    return worksheet
+
+
+def open_survey():
+    """
+    Returns the survey worksheet for the configured backend. Calls on the
+    live sheet go through the quota-aware scheduler (see scheduler.py), and
+    calls on either are recorded if tracing is enabled (see tracing.py).
+    """
+    if BACKEND == "local":
+        if not os.path.exists(LOCAL_FILE):
+            raise FileNotFoundError(
+                f"Local survey file '{LOCAL_FILE}' not found. Create it with "
+                "'python3 storage.py pull'.")
+        worksheet = LocalWorksheet.load(LOCAL_FILE)
+    else:
+        worksheet = scheduler.ScheduledWorksheet(connect_gspread(),
+                                                 scheduler.SCHEDULER)
+    return tracing.TRACER.wrap(worksheet)
+
+
+def open_attributes(survey):
+    """
+    Returns the optional worksheet of respondent attributes (such as
+    department, site or tenure) belonging to the survey, or None if there
+    is none. It holds a "Name" column matching the survey's names followed
+    by one column per attribute. For the local backend it is kept in its
+    own file (SURVEY_LOCAL_ATTRIBUTES_FILE).
+    """
+    if BACKEND == "local":
+        if not os.path.exists(LOCAL_ATTRIBUTES_FILE):
+            return None
+        worksheet = LocalWorksheet.load(LOCAL_ATTRIBUTES_FILE)
+    else:
+        try:
+            worksheet = survey.spreadsheet.worksheet(
+                ATTRIBUTES_WORKSHEET_NAME)
+        except gspread.WorksheetNotFound:
+            return None
+        worksheet = scheduler.ScheduledWorksheet(worksheet,
+                                                 scheduler.SCHEDULER)
+    return tracing.TRACER.wrap(worksheet)
+
+
+class LocalSpreadsheet:
+    """
+    Minimal stand-in for the gspread Spreadsheet owning a LocalWorksheet,
+    so that spreadsheet-level batch updates work with either backend.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def batch_update(self, body):
+        self.worksheet.apply_requests(body["requests"])
+        return {"replies": [{} for request in body["requests"]]}
+
+
+def cell_data(value=None, note=None):
+    """
+    Returns the Sheets API CellData for a cell value and/or note. Numbers
+    are stored as numbers and anything else as a string.
+    """
+    data = {}
+    if value is not None:
+        if isinstance(value, (int, float)):
+            data["userEnteredValue"] = {"numberValue": value}
+        else:
+            data["userEnteredValue"] = {"stringValue": str(value)}
+    if note is not None:
+        data["note"] = note
+    return data
+
+
+def grid_range(worksheet, first_row, first_col, last_row, last_col):
+    """
+    Converts 1-indexed, inclusive cell boundaries into a Sheets API
+    GridRange (0-indexed, end exclusive) on the given worksheet.
+    """
+    return {
+        "sheetId": worksheet.id,
+        "startRowIndex": first_row - 1,
+        "endRowIndex": last_row,
+        "startColumnIndex": first_col - 1,
+        "endColumnIndex": last_col,
+        }
+
+
+def update_cells_request(worksheet, first_row, first_col, rows, fields):
+    """
+    Returns an updateCells request writing a block of CellData (a list of
+    rows) with its top left corner at the given cell.
+    """
+    last_row = first_row + len(rows) - 1
+    last_col = first_col + max(len(row) for row in rows) - 1
+    return {"updateCells": {
+        "range": grid_range(worksheet, first_row, first_col, last_row,
+                            last_col),
+        "rows": [{"values": row} for row in rows],
+        "fields": fields,
+        }}
+
+
+def repeat_cell_request(worksheet, first_row, first_col, last_row, last_col,
+                        cell, fields):
+    """
+    Returns a repeatCell request writing the same CellData to every cell in
+    the given range. The request size does not depend on the range size.
+    """
+    return {"repeatCell": {
+        "range": grid_range(worksheet, first_row, first_col, last_row,
+                            last_col),
+        "cell": cell,
+        "fields": fields,
+        }}
+
+
+def delete_columns_request(worksheet, start_index, end_index=None):
+    """
+    Returns a deleteDimension request removing the given 1-indexed columns,
+    like Worksheet.delete_columns but for use within a batch.
+    """
+    end_index = end_index or start_index
+    return {"deleteDimension": {"range": {
+        "sheetId": worksheet.id,
+        "dimension": "COLUMNS",
+        "startIndex": start_index - 1,
+        "endIndex": end_index,
+        }}}
+
+
+def append_columns_request(worksheet, length):
+    """
+    Returns an appendDimension request adding the given number of empty
+    columns to the right of the worksheet, like Worksheet.add_cols but for
+    use within a batch.
+    """
+    return {"appendDimension": {
+        "sheetId": worksheet.id,
+        "dimension": "COLUMNS",
+        "length": length,
+        }}
+
+
+def batch_requests(worksheet, requests):
+    """
+    Sends a list of Sheets API requests to the worksheet's spreadsheet as a
+    single batchUpdate, which the API applies atomically and in order.
+    """
+    if not requests:
+        return None
+    response = worksheet.spreadsheet.batch_update({"requests": requests})
+    # gspread keeps its own copy of the grid size, which its methods adjust
+    # after resizing. Requests sent directly must do the same.
+    properties = getattr(worksheet, "_properties", None)
+    if properties is not None:
+        grid_properties = properties["gridProperties"]
+        for request in requests:
+            if "deleteDimension" in request:
+                dimension = request["deleteDimension"]["range"]
+                count = dimension["endIndex"] - dimension["startIndex"]
+            elif "appendDimension" in request:
+                dimension = request["appendDimension"]
+                count = -dimension["length"]
+            else:
+                continue
+            key = "rowCount" if dimension["dimension"] == "ROWS" \
+                else "columnCount"
+            grid_properties[key] -= count
+    return response
+
+
+class WriteBatch:
+    """
+    Collects cell writes and sends them to the sheet as a single
+    batch_update request when committed, instead of one update_cell request
+    per cell. Neighbouring cells in the same row are sent as one range.
+    Can be used as a context manager, committing on a clean exit.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self._cells = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def update_cell(self, row, col, value):
+        self._cells[(row, col)] = value
+
+    def ranges(self):
+        """
+        Groups the pending cells into runs of adjacent cells within a row,
+        returned in the batch_update data format.
+        """
+        data = []
+        run_start = None
+        run_values = []
+        previous = None
+        for row, col in sorted(self._cells):
+            if previous != (row, col - 1):
+                if run_values:
+                    data.append(self._range_data(run_start, run_values))
+                run_start = (row, col)
+                run_values = []
+            run_values.append(self._cells[(row, col)])
+            previous = (row, col)
+        if run_values:
+            data.append(self._range_data(run_start, run_values))
+        return data
+
+    def _range_data(self, start, values):
+        row, col = start
+        first_cell = rowcol_to_a1(row, col)
+        last_cell = rowcol_to_a1(row, col + len(values) - 1)
+        return {"range": f"{first_cell}:{last_cell}", "values": [values]}
+
+    def commit(self):
+        """
+        Sends all pending writes in one request. Values are entered as if
+        typed by a user, as update_cell does, so numbers stay numeric.
+        """
+        if not self._cells:
+            return
+        self.worksheet.batch_update(
+            self.ranges(), value_input_option=ValueInputOption.user_entered)
+        self._cells = {}
+
+
+def iter_rows(worksheet, first_row=1, page_size=PAGE_SIZE):
+    """
+    Yields the rows of the sheet from first_row downwards, fetching them in
+    pages of page_size rows instead of a single get_all_values() response.
+    Only one page is held at a time, and callers can start working on the
+    first rows before the rest have been downloaded.
+
+    The API leaves out the empty rows at the end of each page, so a short
+    page need not be the last. Paging carries on to the end of the grid,
+    and the left out rows are yielded as empty rows only if more rows
+    follow them, so that each row keeps its position and the result
+    matches get_all_values().
+    """
+    last_col = worksheet.col_count
+    start = first_row
+    blank_rows = 0
+    while start <= worksheet.row_count:
+        end = start + page_size - 1
+        page = worksheet.get_values(f"A{start}:{rowcol_to_a1(end, last_col)}")
+        if page:
+            for _ in range(blank_rows):
+                yield []
+            yield from page
+            blank_rows = 0
+        blank_rows += page_size - len(page)
+        start = end + 1
+
+
+def get_version(worksheet):
+    """
+    Returns a cheap marker which changes whenever the survey is written to:
+    the write counter of a local sheet, or the Drive modified time of the
+    Google spreadsheet. Returns None if the version cannot be determined.
+    """
+    version = getattr(worksheet, "version", None)
+    if version is not None:
+        return version
+    try:
+        return worksheet.spreadsheet.get_lastUpdateTime()
+    except (AttributeError, gspread.exceptions.GSpreadException):
+        return None
+
+
+class LazyWorksheet:
+    """
+    Stands in for the survey worksheet until it is first used, so the menus
+    can be shown straight away and sessions which exit without touching the
+    survey make no API calls at all. Every attribute is passed through to
+    the real worksheet once it has been opened.
+    """
+
+    def __init__(self, opener=open_survey):
+        self._opener = opener
+        self._worksheet = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """
+        Returns the real worksheet, opening it on first use. Safe to call
+        from several threads at once; the worksheet is only opened once.
+        """
+        if self._worksheet is None:
+            with self._lock:
+                if self._worksheet is None:
+                    self._worksheet = self._opener()
+        return self._worksheet
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+if __name__ == "__main__":
+    # 'python3 storage.py pull [path]' downloads a local copy of the sheet
+    if len(sys.argv) > 1 and sys.argv[1] == "pull":
+        BACKEND = "gspread"
+        target = sys.argv[2] if len(sys.argv) > 2 else LOCAL_FILE
+        survey = open_survey()
+        LocalWorksheet.copy_of(survey, target)
+        print(f"Survey copied to {target}.")
+        attributes = open_attributes(survey)
+        if attributes is not None:
+            LocalWorksheet.copy_of(attributes, LOCAL_ATTRIBUTES_FILE)
+            print(f"Respondent attributes copied to "
+                  f"{LOCAL_ATTRIBUTES_FILE}.")
+    else:
+        print("Usage: python3 storage.py pull [path]")
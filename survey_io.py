@@ -0,0 +1,207 @@
+"""
+Bulk transfer of survey data between the sheet and local files.
+
+read_import_file() reads a CSV file of respondents collected elsewhere (e.g.
+on paper or offline) and validates every line locally, against the current
+questions and the names already in the survey, before anything is written.
+append_in_batches() then adds the accepted rows with a few append_rows()
+requests rather than one request per respondent.
+
+export_survey() writes the survey and its statistics to a directory of
+local files, so downstream tools can use them without the Sheets API:
+
+- questions.csv: each question's summary and full text, with the number
+  of valid responses, mean and variance
+- responses.csv: the grid (name and scores), with each respondent's number
+  of valid responses, mean, variance, lowest and highest score
+- scores.npy: the score matrix as a NumPy int8 array, one row per
+  respondent (in the order of responses.csv) stored column by column, with
+  0 marking a blank or invalid response; np.load(path, mmap_mode="r")
+  reads single questions without loading the whole file
+
+The respondent rows are streamed through in chunks of analytics.CHUNK_SIZE,
+so memory use does not grow with the size of the survey.
+"""
+import csv
+import math
+import os
+from itertools import islice
+
+import numpy as np
+
+import analytics
+
+# Number of respondents appended to the sheet per request when importing
+IMPORT_BATCH_SIZE = 500
+# Directory written to by export_survey() unless another is given
+EXPORT_DIRECTORY = "survey_export"
+
+
+def import_row_error(row, question_count, names):
+    """
+    Returns the reason a CSV row (name followed by scores) cannot be
+    imported, or None if it is valid. Names must be new to the survey.
+    """
+    name = row[0]
+    scores = row[1:]
+    if not name:
+        return "missing name"
+    if name in names:
+        return f"respondent '{name}' already exists"
+    if len(scores) != question_count:
+        return f"expected {question_count} scores, found {len(scores)}"
+    invalid_scores = [score for score in scores
+                      if analytics.score_code(score) == analytics.INVALID]
+    if invalid_scores:
+        return f"invalid score(s) {', '.join(map(repr, invalid_scores))} - " \
+            "scores must be whole numbers from 1 to 5"
+    return None
+
+
+def read_import_file(path, question_count, existing_names):
+    """
+    Reads a CSV file of respondents to import: one line per respondent,
+    holding their name followed by one score per question, in question
+    order. A first line starting with "Name" is taken as a heading and
+    skipped, as are blank lines. Returns the list of accepted rows and a
+    list of (line number, reason) pairs for the rejected lines. A name used
+    twice in the file is accepted the first time only.
+    """
+    accepted = []
+    rejected = []
+    names = set(existing_names)
+    with open(path, newline="", encoding="utf-8-sig") as import_file:
+        reader = csv.reader(import_file)
+        for row in reader:
+            row = [value.strip() for value in row]
+            if not any(row):
+                continue
+            if reader.line_num == 1 and row[0].lower() == "name":
+                continue
+            reason = import_row_error(row, question_count, names)
+            if reason is None:
+                accepted.append(row)
+                names.add(row[0])
+            else:
+                rejected.append((reader.line_num, reason))
+    return accepted, rejected
+
+
+def append_in_batches(worksheet, rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Appends the rows to the worksheet with one append_rows() request per
+    batch_size rows, yielding each batch once it has been written.
+    """
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        worksheet.append_rows(batch)
+        yield batch
+
+
+def format_statistic(value):
+    """
+    Formats a statistic for CSV output, leaving it blank where undefined.
+    """
+    value = float(value)
+    return "" if math.isnan(value) else round(value, 4)
+
+
+def write_questions_file(path, summaries, full_questions, aggregates):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = aggregates.question_means()
+        variances = aggregates.question_variances()
+    with open(path, "w", newline="", encoding="utf-8") as questions_file:
+        writer = csv.writer(questions_file)
+        writer.writerow(["Number", "Summary", "Question", "Responses",
+                         "Mean", "Variance"])
+        for index, summary in enumerate(summaries):
+            full_question = full_questions[index] \
+                if index < len(full_questions) else ""
+            writer.writerow([index + 1, summary, full_question,
+                             int(aggregates.counts[index]),
+                             format_statistic(means[index]),
+                             format_statistic(variances[index])])
+
+
+def export_survey(survey_snapshot, full_questions,
+                  directory=EXPORT_DIRECTORY):
+    """
+    Exports the survey held by the snapshot (see snapshot.py), with the
+    given full question texts, to questions.csv, responses.csv and
+    scores.npy in the directory, creating it if required. Returns the number
+    of respondents exported.
+
+    The respondent rows are read once: each chunk is written to
+    responses.csv, added to the question aggregates and spooled to a
+    temporary file, from which scores.npy is written once the number of
+    rows is known.
+    """
+    os.makedirs(directory, exist_ok=True)
+    headings = survey_snapshot.headings()
+    summaries = headings[1:]
+    question_count = len(summaries)
+    aggregates = analytics.RunningAggregates.empty(question_count)
+    scores_path = os.path.join(directory, "scores.npy")
+    spool_path = scores_path + ".tmp"
+    rows = survey_snapshot.iter_respondent_rows()
+    exported = 0
+    with open(os.path.join(directory, "responses.csv"), "w", newline="",
+              encoding="utf-8") as responses_file, \
+            open(spool_path, "wb") as spool_file:
+        writer = csv.writer(responses_file)
+        writer.writerow(headings + ["Responses", "Mean", "Variance",
+                                    "Lowest", "Highest"])
+        while True:
+            chunk = list(islice(rows, analytics.CHUNK_SIZE))
+            if not chunk:
+                break
+            chunk_scores = analytics.SurveyScores.from_rows(headings, chunk)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                statistics = zip(chunk_scores.respondent_counts(),
+                                 chunk_scores.respondent_means(),
+                                 chunk_scores.respondent_variances(),
+                                 chunk_scores.respondent_minimums(),
+                                 chunk_scores.respondent_maximums())
+            for row, (count, mean, variance, lowest, highest) in zip(
+                    chunk, statistics):
+                values = row[:question_count + 1]
+                values += [""] * (question_count + 1 - len(values))
+                writer.writerow(values + [
+                    int(count), format_statistic(mean),
+                    format_statistic(variance),
+                    int(lowest) or "", int(highest) or ""])
+            aggregates.histograms += analytics.score_histograms(
+                chunk_scores.matrix)
+            aggregates.respondent_count += len(chunk)
+            spool_file.write(np.ascontiguousarray(
+                chunk_scores.matrix, dtype=np.int8).tobytes())
+            exported += len(chunk)
+    write_questions_file(os.path.join(directory, "questions.csv"),
+                         summaries, full_questions, aggregates)
+    write_scores_file(scores_path, spool_path, exported, question_count)
+    return exported
+
+
+def write_scores_file(path, spool_path, respondent_count, question_count):
+    """
+    Writes scores.npy, stored column by column, from the score matrix
+    spooled row by row to a temporary file, copying CHUNK_SIZE rows at a
+    time. The temporary file is then removed.
+    """
+    try:
+        if respondent_count == 0 or question_count == 0:
+            np.save(path, np.zeros((respondent_count, question_count),
+                                   dtype=np.int8, order="F"))
+            return
+        spooled = np.memmap(spool_path, dtype=np.int8, mode="r",
+                            shape=(respondent_count, question_count))
+        scores = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.int8,
+            shape=(respondent_count, question_count), fortran_order=True)
+        for first in range(0, respondent_count, analytics.CHUNK_SIZE):
+            last = first + analytics.CHUNK_SIZE
+            scores[first:last] = spooled[first:last]
+        scores.flush()
+        del scores, spooled
+    finally:
+        os.remove(spool_path)
@@ -0,0 +1,244 @@
+"""
+Tracing of the requests made to the survey worksheet.
+
+When enabled, the worksheet returned by storage.open_survey() is wrapped in
+a TracedWorksheet, which records every method call on it (and on its
+spreadsheet): the wall time taken, including any wait in the scheduler,
+and the bytes transferred, measured as the size of the arguments and the
+result encoded as JSON. Calls are totalled per method and per menu command
+(see Tracer.begin_command()), a summary is printed to stderr when the
+application exits, and each call and command can also be written to a
+file as JSON lines for tracking API cost over time.
+
+The command being run is held in a context variable, so where several
+sessions share the application (see service.py), each session's calls are
+counted against its own command.
+
+Tracing is enabled by setting SURVEY_TRACE=1, or by setting
+SURVEY_TRACE_FILE to the path of the JSON lines file to append to.
+"""
+import atexit
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_FILE = os.environ.get("SURVEY_TRACE_FILE")
+ENABLED = bool(os.environ.get("SURVEY_TRACE") or TRACE_FILE)
+
+
+def payload_size(value):
+    """
+    Returns the size in bytes of the value encoded as JSON, as an estimate
+    of the data sent or received for it.
+    """
+    try:
+        return len(json.dumps(value, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class Totals:
+    """
+    Running totals for a group of calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+
+    def add(self, seconds, bytes_sent, bytes_received, failed):
+        self.calls += 1
+        self.errors += failed
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.seconds += seconds
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "api_seconds": round(self.seconds, 4),
+            }
+
+
+class CommandRun:
+    """
+    A run of a menu command: its name, when it started and the totals of
+    the calls made during it.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.start = time.perf_counter()
+        self.totals = Totals()
+
+
+class Tracer:
+    """
+    Records worksheet calls while enabled. Safe to use from several threads
+    at once; calls made during a command are counted against it. The
+    command is tracked per context, so threads started for a command must
+    run in a copy of its context (see contextvars.copy_context()).
+    """
+
+    def __init__(self, enabled=ENABLED, trace_file=TRACE_FILE):
+        self.enabled = enabled
+        self.trace_file = trace_file
+        self.methods = {}
+        self.commands = {}
+        self._command_run = contextvars.ContextVar("command_run",
+                                                   default=None)
+        self._lock = threading.Lock()
+
+    @property
+    def command(self):
+        command_run = self._command_run.get()
+        return None if command_run is None else command_run.command
+
+    def wrap(self, worksheet):
+        """
+        Returns the worksheet wrapped for tracing, or unchanged if tracing is
+        disabled.
+        """
+        if not self.enabled:
+            return worksheet
+        return TracedWorksheet(worksheet, self)
+
+    def write(self, record):
+        if self.trace_file:
+            with open(self.trace_file, "a", encoding="utf-8") as trace:
+                trace.write(json.dumps(record) + "\n")
+
+    def record(self, method, seconds, bytes_sent, bytes_received, error):
+        failed = error is not None
+        command_run = self._command_run.get()
+        with self._lock:
+            self.methods.setdefault(method, Totals()).add(
+                seconds, bytes_sent, bytes_received, failed)
+            if command_run is not None:
+                command_run.totals.add(seconds, bytes_sent, bytes_received,
+                                       failed)
+            self.write({
+                "type": "call", "time": time.time(),
+                "command": self.command,
+                "method": method, "seconds": round(seconds, 4),
+                "bytes_sent": bytes_sent, "bytes_received": bytes_received,
+                "error": None if error is None else repr(error),
+                })
+
+    def begin_command(self, command):
+        """
+        Starts counting calls against a menu command, ending the previous
+        command if it was not ended (e.g. when the user returned home).
+        """
+        if not self.enabled:
+            return
+        self.end_command()
+        self._command_run.set(CommandRun(command))
+
+    def end_command(self):
+        """
+        Ends the current command, adding its totals to the command's and
+        writing them to the trace file. Called as soon as the command has
+        finished, so that its time does not include the menu prompts
+        before the next one.
+        """
+        command_run = self._command_run.get()
+        if not self.enabled or command_run is None:
+            return
+        self._command_run.set(None)
+        with self._lock:
+            seconds = time.perf_counter() - command_run.start
+            runs, totals = self.commands.get(command_run.command,
+                                             (0, Totals()))
+            command_totals = command_run.totals
+            totals.calls += command_totals.calls
+            totals.errors += command_totals.errors
+            totals.bytes_sent += command_totals.bytes_sent
+            totals.bytes_received += command_totals.bytes_received
+            totals.seconds += command_totals.seconds
+            self.commands[command_run.command] = (runs + 1, totals)
+            self.write(dict(type="command", time=time.time(),
+                            command=command_run.command,
+                            seconds=round(seconds, 4),
+                            **command_totals.as_dict()))
+
+    def summary(self):
+        """
+        Returns the totals per command and per method as lines of text.
+        """
+        lines = ["API CALLS PER COMMAND",
+                 f"{'COMMAND':<12}{'RUNS':>6}{'CALLS':>7}{'KB SENT':>10}"
+                 f"{'KB RECV':>10}{'API SECS':>10}"]
+        for command, (runs, totals) in self.commands.items():
+            lines.append(f"{command:<12}{runs:>6}{totals.calls:>7}"
+                         f"{totals.bytes_sent / 1024:>10.1f}"
+                         f"{totals.bytes_received / 1024:>10.1f}"
+                         f"{totals.seconds:>10.3f}")
+        lines += ["", "API CALLS PER METHOD",
+                  f"{'METHOD':<18}{'CALLS':>7}{'ERRORS':>8}{'KB SENT':>10}"
+                  f"{'KB RECV':>10}{'SECS':>9}"]
+        for method, totals in sorted(self.methods.items()):
+            lines.append(f"{method:<18}{totals.calls:>7}{totals.errors:>8}"
+                         f"{totals.bytes_sent / 1024:>10.1f}"
+                         f"{totals.bytes_received / 1024:>10.1f}"
+                         f"{totals.seconds:>9.3f}")
+        return lines
+
+    def report(self):
+        """
+        Ends the current command and prints the summary to stderr.
+        """
+        if not self.enabled:
+            return
+        self.end_command()
+        print("\n".join(self.summary()), file=sys.stderr)
+
+
+class TracedWorksheet:
+    """
+    Wraps a worksheet (or its spreadsheet) so that every method call is
+    recorded by the tracer. Other attributes are passed through.
+    """
+
+    def __init__(self, target, tracer):
+        self._target = target
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name == "spreadsheet":
+            return TracedWorksheet(value, self._tracer)
+        if not callable(value):
+            return value
+
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            result = None
+            error = None
+            try:
+                result = value(*args, **kwargs)
+                return result
+            except Exception as exception:
+                error = exception
+                raise
+            finally:
+                self._tracer.record(
+                    name, time.perf_counter() - start,
+                    payload_size([args, kwargs]), payload_size(result),
+                    error)
+        return traced
+
+
+# Shared by every traced worksheet
+TRACER = Tracer()
+if TRACER.enabled:
+    atexit.register(TRACER.report)